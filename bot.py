@@ -2,94 +2,238 @@
 Main bot module that handles Telegram interactions and coordinates all components.
 """
 
+import hashlib
 import logging
 import os
 import json
+import secrets
+import operator
+from functools import cached_property, reduce
+from typing import TYPE_CHECKING, Any, Callable, Dict, NamedTuple, Optional
 from telegram.ext import Updater, MessageHandler, CommandHandler, CallbackQueryHandler, Filters
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, BotCommand
+from telegram import Animation, Audio, Document, PhotoSize, Video, Voice
+from telegram.error import NetworkError
+from telegram.utils.helpers import is_local_file
 from telegram.ext import CallbackContext
-from db_storage import DatabaseStorage
-from multi_user_scheduler import MultiUserScheduler
 from config import Config
 
+if TYPE_CHECKING:
+    from db_storage import DatabaseStorage
+    from multi_user_scheduler import MultiUserScheduler
+
 logger = logging.getLogger(__name__)
 
+# Seconds a /clear selection menu stays valid
+CLEAR_MENU_TTL = 300
+# Notes listed per page of the /clear menu
+CLEAR_PAGE_SIZE = 10
+
+# Downloaded media is stored under FILES_DIR/<MediaSpec.subdir>/
+FILES_DIR = "files"
+
+# Media downloads are streamed to disk in chunks of this size
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+DOWNLOAD_TIMEOUT = 60  # seconds
+
+# Plain text messages that aren't commands are saved as text notes
+_TEXT_FILTER = Filters.text & ~Filters.command
+
+def _file_extension(file_path: str, default: str) -> str:
+    """Return the extension of a Telegram file path, or default if it has none."""
+    extension = os.path.splitext(file_path)[1]
+    return extension[1:] if extension else default
+
+class MediaSpec(NamedTuple):
+    """Describes how one kind of attachment is downloaded and stored as a note."""
+    filter: Any                 # Message filter selecting this attachment type
+    note_type: str              # Value stored in Note.note_type
+    name: str                   # Used in replies, e.g. "Failed to save <name>"
+    label: str                  # Used in replies, e.g. "<label> saved!"
+    subdir: str                 # Folder under files/ where downloads go
+    get_media: Callable         # message -> attachment object
+    filename: Callable          # (user_id, media, telegram file path) -> local file name
+    content: Callable           # (message, media) -> note content
+    metadata: Callable          # (message, media) -> type-specific metadata
+
+# Attachment types saved as notes, keyed by the Message attribute holding them
+MEDIA_SPECS: Dict[str, MediaSpec] = {
+    'photo': MediaSpec(
+        filter=Filters.photo,
+        note_type='image',
+        name='image',
+        label='📷 Image',
+        subdir='images',
+        get_media=lambda message: message.photo[-1],  # Largest size
+        filename=lambda user_id, media, path: f"{user_id}_{media.file_id}.{_file_extension(path, 'jpg')}",
+        content=lambda message, media: f"📷 Image: {message.caption or 'No caption'}",
+        metadata=lambda message, media: {
+            'width': media.width,
+            'height': media.height,
+            'caption': message.caption or ''
+        }
+    ),
+    'voice': MediaSpec(
+        filter=Filters.voice,
+        note_type='voice',
+        name='voice message',
+        label='🎤 Voice message',
+        subdir='voice',
+        get_media=lambda message: message.voice,
+        filename=lambda user_id, media, path: f"{user_id}_{media.file_id}.ogg",
+        content=lambda message, media: f"🎤 Voice message ({media.duration}s)",
+        metadata=lambda message, media: {
+            'duration': media.duration,
+            'mime_type': media.mime_type
+        }
+    ),
+    'document': MediaSpec(
+        filter=Filters.document,
+        note_type='document',
+        name='document',
+        label='📄 Document',
+        subdir='documents',
+        get_media=lambda message: message.document,
+        filename=lambda user_id, media, path: f"{user_id}_{media.file_id}_{media.file_name}",
+        content=lambda message, media: f"📄 Document: {media.file_name} ({message.caption or 'No caption'})",
+        metadata=lambda message, media: {
+            'file_name': media.file_name,
+            'mime_type': media.mime_type,
+            'caption': message.caption or ''
+        }
+    ),
+    'video': MediaSpec(
+        filter=Filters.video,
+        note_type='video',
+        name='video',
+        label='🎥 Video',
+        subdir='videos',
+        get_media=lambda message: message.video,
+        filename=lambda user_id, media, path: f"{user_id}_{media.file_id}.{_file_extension(path, 'mp4')}",
+        content=lambda message, media: f"🎥 Video ({media.duration}s): {message.caption or 'No caption'}",
+        metadata=lambda message, media: {
+            'duration': media.duration,
+            'width': media.width,
+            'height': media.height,
+            'mime_type': media.mime_type,
+            'caption': message.caption or ''
+        }
+    ),
+    'audio': MediaSpec(
+        filter=Filters.audio,
+        note_type='audio',
+        name='audio',
+        label='🎵 Audio',
+        subdir='audio',
+        get_media=lambda message: message.audio,
+        filename=lambda user_id, media, path: f"{user_id}_{media.file_id}.{_file_extension(path, 'mp3')}",
+        content=lambda message, media: (
+            f"🎵 Audio: {media.title or media.file_name or 'Untitled'} "
+            f"by {media.performer or 'Unknown artist'} ({message.caption or 'No caption'})"
+        ),
+        metadata=lambda message, media: {
+            'duration': media.duration,
+            'performer': media.performer,
+            'title': media.title,
+            'mime_type': media.mime_type,
+            'caption': message.caption or ''
+        }
+    ),
+}
+
+# One filter matching every attachment type above, so a single handler check
+# covers all media messages
+_MEDIA_FILTER = reduce(operator.or_, (spec.filter for spec in MEDIA_SPECS.values()))
+
+# Message.effective_attachment type -> spec. GIFs arrive as an Animation that
+# also carries a document, and are saved as documents.
+_ATTACHMENT_SPECS: Dict[type, MediaSpec] = {
+    PhotoSize: MEDIA_SPECS['photo'],
+    Voice: MEDIA_SPECS['voice'],
+    Document: MEDIA_SPECS['document'],
+    Animation: MEDIA_SPECS['document'],
+    Video: MEDIA_SPECS['video'],
+    Audio: MEDIA_SPECS['audio'],
+}
+
+def create_storage(config: Config) -> "DatabaseStorage":
+    """
+    Create the database storage described by the configuration.
+    
+    Args:
+        config: Configuration instance
+        
+    Returns:
+        DatabaseStorage: Storage with its own engine and connection pool
+    """
+    from db_storage import DatabaseStorage
+    
+    return DatabaseStorage(
+        config.database_url,
+        pool_size=config.db_pool_size,
+        max_overflow=config.db_max_overflow,
+        pool_timeout=config.db_pool_timeout,
+        pool_recycle=config.db_pool_recycle
+    )
+
 class NotesBot:
     """Main bot class that handles all Telegram interactions."""
     
-    def __init__(self, config: Config):
+    def __init__(self, config: Config, storage: "DatabaseStorage" = None):
         """
         Initialize the notes bot.
         
         Args:
             config: Configuration instance
+            storage: Existing storage to reuse, e.g. across restarts so its
+                connection pool stays warm; created on first use if omitted
         """
         self.config = config
-        self.storage = DatabaseStorage(config.database_url)
-        self.scheduler = MultiUserScheduler(config.bot_token, self.storage, config)
-        self.updater = Updater(config.bot_token, use_context=True)
+        if storage is not None:
+            self.storage = storage
         
-        # Set up handlers
-        self._setup_handlers()
+        # Create the download folders once instead of checking per message
+        for spec in MEDIA_SPECS.values():
+            os.makedirs(os.path.join(FILES_DIR, spec.subdir), exist_ok=True)
         
-        # Set up command menu
-        self._setup_command_menu()
-    
-    def _setup_handlers(self):
-        """Set up message and command handlers."""
-        dp = self.updater.dispatcher
+        self.updater = Updater(
+            config.bot_token,
+            use_context=True,
+            workers=config.bot_workers
+        )
         
-        # Command handlers
-        dp.add_handler(CommandHandler("start", self.start_command))
-        dp.add_handler(CommandHandler("help", self.help_command))
-        dp.add_handler(CommandHandler("stats", self.stats_command))
-        dp.add_handler(CommandHandler("test", self.test_command))
-        dp.add_handler(CommandHandler("clear", self.clear_command))
-        dp.add_handler(CommandHandler("clearall", self.clear_all_command))
+        # Precompute replies that only depend on configuration
+        self._build_reply_texts()
         
-        # Callback query handler for inline buttons
-        dp.add_handler(CallbackQueryHandler(self.button_callback))
+        # Set up handlers
+        self._setup_handlers()
+    
+    @cached_property
+    def storage(self) -> "DatabaseStorage":
+        """
+        Database storage, created on first use.
         
-        # Message handlers for different content types
-        dp.add_handler(MessageHandler(
-            Filters.text & ~Filters.command, 
-            self.handle_text_message
-        ))
-        dp.add_handler(MessageHandler(
-            Filters.photo, 
-            self.handle_photo_message
-        ))
-        dp.add_handler(MessageHandler(
-            Filters.voice, 
-            self.handle_voice_message
-        ))
-        dp.add_handler(MessageHandler(
-            Filters.document, 
-            self.handle_document_message
-        ))
-        dp.add_handler(MessageHandler(
-            Filters.video, 
-            self.handle_video_message
-        ))
-        dp.add_handler(MessageHandler(
-            Filters.audio, 
-            self.handle_audio_message
-        ))
+        Importing SQLAlchemy and creating the schema is the slowest part of
+        startup, so it is deferred until something actually needs the
+        database.
+        """
+        return create_storage(self.config)
     
-    def start_command(self, update: Update, context: CallbackContext):
-        """Handle /start command."""
-        user = update.message.from_user
-        user_id = str(user.id)
+    @cached_property
+    def scheduler(self) -> "MultiUserScheduler":
+        """Reminder scheduler, created on first use."""
+        from multi_user_scheduler import MultiUserScheduler
         
-        # Save user information
-        self.storage.save_user(
-            user_id=user_id,
-            username=user.username,
-            first_name=user.first_name,
-            last_name=user.last_name
-        )
+        return MultiUserScheduler(self.config.bot_token, self.storage, self.config)
+    
+    def _build_reply_texts(self):
+        """
+        Build the fixed /start, /help and /stats texts once.
         
-        welcome_message = (
+        They only depend on configuration, which does not change while the
+        bot runs.
+        """
+        self._welcome_text = (
             "🗒️ Welcome to Notes Reminder Bot!\n\n"
             "📝 Send me any content and I'll save it as your private note:\n"
             "• Text messages (multiple sentences, lists, charts)\n"
@@ -106,13 +250,8 @@ class NotesBot:
             "/clear - Select and delete individual notes\n"
             "/clearall - Delete all your notes"
         )
-        update.message.reply_text(welcome_message)
         
-        logger.info(f"New user started: {user_id} (@{user.username})")
-    
-    def help_command(self, update: Update, context: CallbackContext):
-        """Handle /help command."""
-        help_message = (
+        self._help_text = (
             "🤖 Notes Reminder Bot Help\n\n"
             "📝 How to use:\n"
             "• Send any content to save it as a note:\n"
@@ -134,18 +273,76 @@ class NotesBot:
             "/clearall - Delete all your notes\n"
             "/help - Show this message"
         )
-        update.message.reply_text(help_message)
+        
+        # /stats lines that don't depend on the user's notes
+        self._stats_footer = (
+            f"⏰ Reminder interval: Every {self.config.reminder_interval_days} days\n"
+            f"🕐 Reminder window: {self.config.reminder_start_hour}:00 - {self.config.reminder_end_hour}:00"
+        )
+    
+    def _setup_handlers(self):
+        """
+        Set up message and command handlers.
+        
+        Every handler is registered with run_async=True so updates are
+        processed on the dispatcher's worker pool. A slow file download or
+        database call for one user no longer holds up everyone else.
+        """
+        dp = self.updater.dispatcher
+        
+        # Command handlers
+        dp.add_handler(CommandHandler("start", self.start_command, run_async=True))
+        dp.add_handler(CommandHandler("help", self.help_command, run_async=True))
+        dp.add_handler(CommandHandler("stats", self.stats_command, run_async=True))
+        dp.add_handler(CommandHandler("test", self.test_command, run_async=True))
+        dp.add_handler(CommandHandler("clear", self.clear_command, run_async=True))
+        dp.add_handler(CommandHandler("clearall", self.clear_all_command, run_async=True))
+        
+        # Callback query handler for inline buttons
+        dp.add_handler(CallbackQueryHandler(self.button_callback, run_async=True))
+        
+        # Message handlers for different content types
+        dp.add_handler(MessageHandler(
+            _TEXT_FILTER,
+            self.handle_text_message,
+            run_async=True
+        ))
+        dp.add_handler(MessageHandler(
+            _MEDIA_FILTER,
+            self.handle_media_message,
+            run_async=True
+        ))
+    
+    def start_command(self, update: Update, context: CallbackContext):
+        """Handle /start command."""
+        user = update.message.from_user
+        user_id = user.id
+        
+        # Save user information
+        self.storage.save_user(
+            user_id=user_id,
+            username=user.username,
+            first_name=user.first_name,
+            last_name=user.last_name
+        )
+        
+        update.message.reply_text(self._welcome_text)
+        
+        logger.info("New user started: %s (@%s)", user_id, user.username)
+    
+    def help_command(self, update: Update, context: CallbackContext):
+        """Handle /help command."""
+        update.message.reply_text(self._help_text)
     
     def stats_command(self, update: Update, context: CallbackContext):
         """Handle /stats command."""
-        user_id = str(update.message.from_user.id)
+        user_id = update.message.from_user.id
         notes_count = self.storage.get_notes_count(user_id)
         
         stats_message = (
             f"📊 Your Notes Statistics\n\n"
             f"📝 Your notes: {notes_count}\n"
-            f"⏰ Reminder interval: Every {self.config.reminder_interval_days} days\n"
-            f"🕐 Reminder window: {self.config.reminder_start_hour}:00 - {self.config.reminder_end_hour}:00"
+            f"{self._stats_footer}"
         )
         
         if notes_count == 0:
@@ -155,7 +352,7 @@ class NotesBot:
     
     def test_command(self, update: Update, context: CallbackContext):
         """Handle /test command - send a test reminder."""
-        user_id = str(update.message.from_user.id)
+        user_id = update.message.from_user.id
         
         if self.scheduler.send_test_reminder(user_id):
             update.message.reply_text("✅ Test reminder sent!")
@@ -167,41 +364,105 @@ class NotesBot:
     
     def clear_command(self, update: Update, context: CallbackContext):
         """Handle /clear command - show notes for selective deletion."""
-        user_id = str(update.message.from_user.id)
-        notes = self.storage.get_notes(user_id)
+        user_id = update.message.from_user.id
         
-        if not notes:
+        # Remember which notes this menu shows so a button tap can delete
+        # by primary key without fetching the user's notes again
+        token = secrets.token_hex(4)
+        shown_notes = {}
+        menu = self._build_clear_menu(user_id, token, shown_notes, 0)
+        
+        if menu is None:
             update.message.reply_text(
                 "📝 You don't have any notes to delete.\n"
                 "Send me some messages first!"
             )
             return
         
-        # Create inline keyboard with notes (max 10 per page)
+        context.user_data.setdefault('clear_menus', {})[token] = shown_notes
+        context.job_queue.run_once(
+            self._expire_clear_menu,
+            CLEAR_MENU_TTL,
+            context=(context.user_data, token)
+        )
+        
+        message_text, reply_markup = menu
+        update.message.reply_text(message_text, reply_markup=reply_markup)
+    
+    def _build_clear_menu(self, user_id: int, token: str, shown_notes: dict, offset: int,
+                          after_id: Optional[int] = None, before_id: Optional[int] = None):
+        """
+        Build the text and keyboard for one page of the /clear menu.
+        
+        The navigation buttons carry the id of the note next to the page
+        they lead to, so moving between pages is a keyset lookup however
+        deep the page is; only the first page is read by offset.
+        
+        Args:
+            user_id: Telegram user ID
+            token: Key of this menu in user_data['clear_menus']
+            shown_notes: Cache of note id -> preview for this menu, updated in place
+            offset: Index of the first note on the page
+            after_id: Show the notes listed right after this note
+            before_id: Show the notes listed right before this note
+            
+        Returns:
+            tuple: (message text, InlineKeyboardMarkup), or None if the page
+                is empty
+        """
+        notes, notes_count = self.storage.get_notes_page(
+            user_id, offset, CLEAR_PAGE_SIZE, after_id=after_id, before_id=before_id
+        )
+        if not notes:
+            return None
+        shown_notes.update(notes)
+        
+        # Create inline keyboard with one page of notes
         keyboard = []
-        for i, note in enumerate(notes[:10]):  # Limit to first 10 notes
+        for note_id, content in notes:
             # Truncate long notes for display
-            display_text = note[:50] + "..." if len(note) > 50 else note
+            display_text = content[:50] + "..." if len(content) > 50 else content
             keyboard.append([InlineKeyboardButton(
                 f"🗑️ {display_text}", 
-                callback_data=f"delete_{i}"
+                callback_data=f"del_{token}_{note_id}"
             )])
         
+        # Add page navigation buttons
+        navigation = []
+        if offset > 0:
+            previous_offset = max(0, offset - CLEAR_PAGE_SIZE)
+            # The first page is read directly, so it is always the newest notes
+            cursor = f"_b{notes[0][0]}" if previous_offset > 0 else ""
+            navigation.append(InlineKeyboardButton(
+                "⬅️ Previous",
+                callback_data=f"page_{token}_{previous_offset}{cursor}"
+            ))
+        if offset + CLEAR_PAGE_SIZE < notes_count:
+            navigation.append(InlineKeyboardButton(
+                "➡️ Next",
+                callback_data=f"page_{token}_{offset + CLEAR_PAGE_SIZE}_a{notes[-1][0]}"
+            ))
+        if navigation:
+            keyboard.append(navigation)
+        
         # Add cancel button
         keyboard.append([InlineKeyboardButton("❌ Cancel", callback_data="cancel")])
         
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
         message_text = (
             "🗑️ Select a note to delete:\n\n"
-            f"Showing {min(10, len(notes))} of {len(notes)} notes"
+            f"Showing {offset + 1}-{offset + len(notes)} of {notes_count} notes"
         )
         
-        update.message.reply_text(message_text, reply_markup=reply_markup)
+        return message_text, InlineKeyboardMarkup(keyboard)
+    
+    def _expire_clear_menu(self, context: CallbackContext):
+        """Drop a /clear menu from user_data once its TTL has passed."""
+        user_data, token = context.job.context
+        user_data.get('clear_menus', {}).pop(token, None)
 
     def clear_all_command(self, update: Update, context: CallbackContext):
         """Handle /clearall command - clear all notes."""
-        user_id = str(update.message.from_user.id)
+        user_id = update.message.from_user.id
         
         if self.storage.clear_notes(user_id):
             update.message.reply_text(
@@ -217,48 +478,96 @@ class NotesBot:
             query = update.callback_query
             query.answer()  # Acknowledge the callback immediately
             
-            logger.info(f"Button callback received: {query.data}")
+            logger.info("Button callback received: %s", query.data)
             
             if query.data == "cancel":
                 query.edit_message_text("❌ Deletion cancelled.")
                 return
             
-            if query.data.startswith("delete_"):
+            if query.data.startswith("page_"):
                 try:
-                    note_index = int(query.data.split("_")[1])
-                    user_id = str(query.from_user.id)
-                    notes = self.storage.get_notes(user_id)
+                    # page_<token>_<offset>[_a<note id>|_b<note id>]
+                    _, token, offset, *cursor = query.data.split("_")
+                    offset = int(offset)
+                    after_id = before_id = None
+                    if cursor and cursor[0].startswith("a"):
+                        after_id = int(cursor[0][1:])
+                    elif cursor and cursor[0].startswith("b"):
+                        before_id = int(cursor[0][1:])
+                    elif cursor:
+                        raise ValueError(f"unknown page cursor {cursor[0]!r}")
+                    user_id = query.from_user.id
+                    shown_notes = context.user_data.get('clear_menus', {}).get(token)
                     
-                    logger.info(f"Attempting to delete note at index {note_index} for user {user_id}, total notes: {len(notes)}")
+                    if shown_notes is None:
+                        query.edit_message_text(
+                            "⌛ This list has expired. Send /clear to see your notes again."
+                        )
+                        return
+                    
+                    menu = self._build_clear_menu(user_id, token, shown_notes, offset, after_id, before_id)
+                    if menu is None and offset > 0:
+                        # Notes were deleted since the menu was shown and the
+                        # page or its cursor note is gone; start over from
+                        # the first page
+                        menu = self._build_clear_menu(user_id, token, shown_notes, 0)
+                    if menu is None:
+                        query.edit_message_text("📝 You don't have any notes to delete.")
+                        return
+                    
+                    message_text, reply_markup = menu
+                    query.edit_message_text(message_text, reply_markup=reply_markup)
+                    
+                except ValueError as e:
+                    logger.error("Invalid page selection format: %s", e)
+                    query.edit_message_text("❌ Invalid selection format.")
+            
+            elif query.data.startswith("del_"):
+                try:
+                    _, token, note_id = query.data.split("_")
+                    note_id = int(note_id)
+                    user_id = query.from_user.id
+                    shown_notes = context.user_data.get('clear_menus', {}).get(token)
                     
-                    if 0 <= note_index < len(notes):
-                        deleted_note = notes[note_index]
-                        logger.info(f"Deleting note: {deleted_note[:30]}...")
+                    if shown_notes is None or note_id not in shown_notes:
+                        query.edit_message_text(
+                            "⌛ This list has expired. Send /clear to see your notes again."
+                        )
+                        logger.info("Expired or unknown note menu %s for user %s", token, user_id)
+                        return
+                    
+                    deleted_note = shown_notes[note_id]
+                    logger.info("Attempting to delete note %s for user %s", note_id, user_id)
+                    
+                    if self.storage.delete_note_by_id(user_id, note_id):
+                        # The menu message is replaced below, so its cache entry is done
+                        context.user_data['clear_menus'].pop(token, None)
                         
-                        if self.storage.delete_note_by_index(user_id, note_index):
-                            # Truncate for display
-                            display_note = deleted_note[:50] + "..." if len(deleted_note) > 50 else deleted_note
-                            query.edit_message_text(
-                                f"✅ Note deleted successfully!\n\n"
-                                f"Deleted: {display_note}"
-                            )
-                            logger.info(f"Note deleted successfully: {deleted_note[:50]}...")
-                        else:
-                            query.edit_message_text("❌ Failed to delete note. Please try again.")
-                            logger.error("Failed to delete note from storage")
+                        # Truncate for display
+                        display_note = deleted_note[:50] + "..." if len(deleted_note) > 50 else deleted_note
+                        query.edit_message_text(
+                            f"✅ Note deleted successfully!\n\n"
+                            f"Deleted: {display_note}"
+                        )
+                        logger.info("Note deleted successfully: %s...", deleted_note[:50])
                     else:
-                        query.edit_message_text("❌ Invalid note selection.")
-                        logger.error(f"Invalid note index: {note_index}")
+                        query.edit_message_text("❌ Failed to delete note. It may have already been deleted.")
+                        logger.error("Failed to delete note %s from storage", note_id)
                         
                 except ValueError as e:
-                    logger.error(f"Invalid note index format: {e}")
+                    logger.error("Invalid note selection format: %s", e)
                     query.edit_message_text("❌ Invalid selection format.")
                 except Exception as e:
-                    logger.error(f"Error processing note deletion: {e}")
+                    logger.error("Error processing note deletion: %s", e)
                     query.edit_message_text("❌ Error deleting note. Please try again.")
+            else:
+                # Buttons from menus created before the current format
+                query.edit_message_text(
+                    "⌛ This list has expired. Send /clear to see your notes again."
+                )
             
         except Exception as e:
-            logger.error(f"Error in button callback: {e}")
+            logger.error("Error in button callback: %s", e)
             try:
                 update.callback_query.edit_message_text("❌ Something went wrong. Please try again.")
             except:
@@ -276,12 +585,61 @@ class NotesBot:
                 BotCommand("clearall", "Delete all your notes")
             ]
             
+            # Telegram keeps the menu between restarts, so only send it when
+            # the commands (or the bot the token belongs to) have changed
+            bot_id = self.config.bot_token.split(':')[0]
+            commands_hash = hashlib.sha256(
+                repr((bot_id, [(c.command, c.description) for c in commands])).encode()
+            ).hexdigest()
+            if self.storage.get_meta('commands_hash') == commands_hash:
+                logger.info("Command menu unchanged, skipping update")
+                return
+            
             # Set the command menu
             self.updater.bot.set_my_commands(commands)
+            self.storage.set_meta('commands_hash', commands_hash)
             logger.info("Command menu set successfully")
             
         except Exception as e:
-            logger.error(f"Failed to set command menu: {e}")
+            logger.error("Failed to set command menu: %s", e)
+    
+    def _download_file(self, file_obj, file_path: str):
+        """
+        Stream a Telegram file to disk.
+        
+        File.download() in python-telegram-bot 13 reads the whole body into
+        memory before writing it out. Copying the response in fixed-size
+        chunks keeps memory flat for large videos and documents. The request
+        goes through the bot's own connection pool, so it uses the same
+        proxy, SSL and pool settings as the Bot API calls.
+        
+        Args:
+            file_obj: telegram.File returned by get_file()
+            file_path: Destination path on disk
+        """
+        if is_local_file(file_obj.file_path):
+            # Local Bot API server: the file is already on this machine
+            file_obj.download(file_path)
+            return
+        
+        # Same URL File.download() would fetch, with non-ASCII characters quoted
+        url = file_obj._get_encoded_url()
+        response = file_obj.bot.request._con_pool.request(
+            'GET', url, preload_content=False, timeout=DOWNLOAD_TIMEOUT
+        )
+        try:
+            if not 200 <= response.status < 300:
+                raise NetworkError(f"File download failed with HTTP {response.status}")
+            with open(file_path, 'wb') as out:
+                for chunk in response.stream(DOWNLOAD_CHUNK_SIZE):
+                    out.write(chunk)
+        except Exception:
+            # Don't leave a truncated file behind for reminders to send
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            raise
+        finally:
+            response.release_conn()
     
     def handle_text_message(self, update: Update, context: CallbackContext):
         """
@@ -293,22 +651,19 @@ class NotesBot:
         """
         text = update.message.text.strip()
         user = update.message.from_user
-        user_id = str(user.id)
+        user_id = user.id
         
         if not text:
             update.message.reply_text("❌ Empty message. Please send some text!")
             return
         
-        # Save/update user information
-        self.storage.save_user(
-            user_id=user_id,
+        # Save the note together with the user's details
+        if self.storage.save_message(
+            user_id, text,
             username=user.username,
             first_name=user.first_name,
             last_name=user.last_name
-        )
-        
-        # Save the note
-        if self.storage.save_note(user_id, text):
+        ):
             notes_count = self.storage.get_notes_count(user_id)
             response = f"📝 Note saved! (Total: {notes_count})"
             
@@ -319,171 +674,103 @@ class NotesBot:
             response = "❌ Failed to save note. Please try again."
         
         update.message.reply_text(response)
-        logger.info(f"Note saved from {user_id} (@{user.username}): {text[:50]}...")
+        logger.info("Note saved from %s (@%s): %s...", user_id, user.username, text[:50])
     
-    def handle_photo_message(self, update: Update, context: CallbackContext):
-        """Handle incoming photo messages and save them as notes."""
-        try:
-            user = update.message.from_user
-            user_id = str(user.id)
-            
-            # Save/update user information
-            self.storage.save_user(
-                user_id=user_id,
-                username=user.username,
-                first_name=user.first_name,
-                last_name=user.last_name
-            )
-            
-            # Get the largest photo
-            photo = update.message.photo[-1]
-            file_id = photo.file_id
-            
-            # Download the file
-            file_obj = context.bot.get_file(file_id)
-            file_extension = file_obj.file_path.split('.')[-1] if '.' in file_obj.file_path else 'jpg'
-            filename = f"{user_id}_{file_id}.{file_extension}"
-            file_path = f"files/images/{filename}"
-            
-            # Download and save the file
-            file_obj.download(file_path)
-            
-            # Prepare metadata
-            metadata = {
-                'file_id': file_id,
-                'file_path': file_path,
-                'file_size': photo.file_size,
-                'width': photo.width,
-                'height': photo.height,
-                'caption': update.message.caption or ''
-            }
-            
-            # Save the note with caption and file path
-            content = f"📷 Image: {update.message.caption or 'No caption'}"
-            
-            if self.storage.save_note(user_id, content, 'image', metadata):
-                notes_count = self.storage.get_notes_count(user_id)
-                response = f"📷 Image saved! (Total: {notes_count})"
-                if notes_count == 1:
-                    response += "\n🎉 Your first note! I'll start sending you reminders."
-            else:
-                response = "❌ Failed to save image. Please try again."
-            
-            update.message.reply_text(response)
-            logger.info(f"Image saved from {user_id} (@{user.username}): {filename}")
-            
-        except Exception as e:
-            logger.error(f"Error handling photo message: {e}")
-            update.message.reply_text("❌ Failed to save image. Please try again.")
+    def handle_media_message(self, update: Update, context: CallbackContext):
+        """Handle incoming attachments, dispatching on the attachment type."""
+        attachment = update.message.effective_attachment
+        if isinstance(attachment, list):
+            attachment = attachment[-1]  # Photos arrive as a list of sizes
+        
+        spec = _ATTACHMENT_SPECS.get(type(attachment))
+        if spec is None:
+            logger.warning("Unsupported attachment type: %s", type(attachment).__name__)
+            return
+        
+        self._handle_media(update, context, spec)
     
-    def handle_voice_message(self, update: Update, context: CallbackContext):
-        """Handle incoming voice messages and save them as notes."""
+    def _handle_media(self, update: Update, context: CallbackContext, spec: MediaSpec):
+        """
+        Handle an incoming attachment and save it as a note.
+        
+        Args:
+            update: Telegram update object
+            context: Callback context
+            spec: Description of the attachment type being handled
+        """
         try:
-            user = update.message.from_user
-            user_id = str(user.id)
+            message = update.message
+            user = message.from_user
+            user_id = user.id
             
-            # Save/update user information
-            self.storage.save_user(
-                user_id=user_id,
-                username=user.username,
-                first_name=user.first_name,
-                last_name=user.last_name
-            )
-            
-            # Get voice message
-            voice = update.message.voice
-            file_id = voice.file_id
+            media = spec.get_media(message)
+            file_id = media.file_id
             
             # Download the file
             file_obj = context.bot.get_file(file_id)
-            filename = f"{user_id}_{file_id}.ogg"
-            file_path = f"files/voice/{filename}"
-            
-            # Download and save the file
-            file_obj.download(file_path)
+            filename = spec.filename(user_id, media, file_obj.file_path)
+            file_path = f"{FILES_DIR}/{spec.subdir}/{filename}"
+            self._download_file(file_obj, file_path)
             
             # Prepare metadata
             metadata = {
                 'file_id': file_id,
                 'file_path': file_path,
-                'file_size': voice.file_size,
-                'duration': voice.duration,
-                'mime_type': voice.mime_type
+                'file_size': media.file_size,
+                **spec.metadata(message, media)
             }
             
             # Save the note
-            content = f"🎤 Voice message ({voice.duration}s)"
-            
-            if self.storage.save_note(user_id, content, 'voice', metadata):
-                notes_count = self.storage.get_notes_count(user_id)
-                response = f"🎤 Voice message saved! (Total: {notes_count})"
-                if notes_count == 1:
-                    response += "\n🎉 Your first note! I'll start sending you reminders."
-            else:
-                response = "❌ Failed to save voice message. Please try again."
-            
-            update.message.reply_text(response)
-            logger.info(f"Voice message saved from {user_id} (@{user.username}): {filename}")
+            content = spec.content(message, media)
             
-        except Exception as e:
-            logger.error(f"Error handling voice message: {e}")
-            update.message.reply_text("❌ Failed to save voice message. Please try again.")
-    
-    def handle_document_message(self, update: Update, context: CallbackContext):
-        """Handle incoming document messages and save them as notes."""
-        try:
-            user = update.message.from_user
-            user_id = str(user.id)
-            
-            # Save/update user information
-            self.storage.save_user(
-                user_id=user_id,
+            if self.storage.save_message(
+                user_id, content, spec.note_type, metadata,
                 username=user.username,
                 first_name=user.first_name,
                 last_name=user.last_name
-            )
-            
-            # Get document
-            document = update.message.document
-            file_id = document.file_id
-            
-            # Download the file
-            file_obj = context.bot.get_file(file_id)
-            filename = f"{user_id}_{file_id}_{document.file_name}"
-            file_path = f"files/documents/{filename}"
-            
-            # Download and save the file
-            file_obj.download(file_path)
-            
-            # Prepare metadata
-            metadata = {
-                'file_id': file_id,
-                'file_path': file_path,
-                'file_size': document.file_size,
-                'file_name': document.file_name,
-                'mime_type': document.mime_type,
-                'caption': update.message.caption or ''
-            }
-            
-            # Save the note
-            content = f"📄 Document: {document.file_name} ({update.message.caption or 'No caption'})"
-            
-            if self.storage.save_note(user_id, content, 'document', metadata):
+            ):
                 notes_count = self.storage.get_notes_count(user_id)
-                response = f"📄 Document saved! (Total: {notes_count})"
+                response = f"{spec.label} saved! (Total: {notes_count})"
                 if notes_count == 1:
                     response += "\n🎉 Your first note! I'll start sending you reminders."
             else:
-                response = "❌ Failed to save document. Please try again."
+                response = f"❌ Failed to save {spec.name}. Please try again."
             
-            update.message.reply_text(response)
-            logger.info(f"Document saved from {user_id} (@{user.username}): {document.file_name}")
+            message.reply_text(response)
+            logger.info("%s saved from %s (@%s): %s", spec.name.capitalize(), user_id, user.username, filename)
             
         except Exception as e:
-            logger.error(f"Error handling document message: {e}")
-            update.message.reply_text("❌ Failed to save document. Please try again.")
+            logger.error("Error handling %s message: %s", spec.name, e)
+            update.message.reply_text(f"❌ Failed to save {spec.name}. Please try again.")
     
-    def handle_video_message(self, update: Update, context: CallbackContext):
-        """Handle incoming video messages and save them as notes."""
+    def start(self):
+        """Start the bot and the reminder scheduler."""
         try:
-            user = update.mess
+            # Set up command menu
+            self._setup_command_menu()
+            
+            # Start the reminder scheduler
+            self.scheduler.start()
+            
+            # Start polling for updates. getUpdates long-polls for up to
+            # `timeout` seconds and returns as soon as an update arrives, so
+            # there is no need to sleep between calls.
+            logger.info("Bot started. Listening for messages...")
+            self.updater.start_polling(
+                poll_interval=0.0,
+                timeout=50,
+                read_latency=2.0,
+                drop_pending_updates=True
+            )
+            self.updater.idle()
+        finally:
+            self.stop()
+    
+    def stop(self):
+        """Stop the reminder scheduler and the updater."""
+        # Don't create the scheduler just to stop it
+        if 'scheduler' in self.__dict__:
+            self.scheduler.stop()
+        if self.updater.running:
+            self.updater.stop()
+        logger.info("Bot stopped")
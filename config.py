@@ -4,37 +4,103 @@ Handles environment variables and application settings.
 """
 
 import os
+from dataclasses import dataclass
 from typing import Optional
 
+@dataclass(frozen=True, slots=True)
 class Config:
-    """Configuration class for bot settings."""
-    
-    def __init__(self):
-        """Initialize configuration from environment variables."""
-        self.bot_token: str = os.getenv("TELEGRAM_BOT_TOKEN", "PASTE_YOUR_TOKEN_HERE")
-        self.database_url: str = os.getenv("DATABASE_URL", "")
-        
-        # Reminder settings
-        self.reminder_start_hour: int = int(os.getenv("REMINDER_START_HOUR", "8"))
-        self.reminder_end_hour: int = int(os.getenv("REMINDER_END_HOUR", "20"))
-        self.reminder_interval_days: int = int(os.getenv("REMINDER_INTERVAL_DAYS", "2"))
-    
-    def validate(self) -> bool:
-        """Validate configuration settings."""
+    """
+    Configuration for bot settings.
+
+    Instances are immutable and validated once on creation, so the values
+    read on hot paths never need re-checking.
+    """
+
+    bot_token: str
+    database_url: str
+
+    # Number of dispatcher worker threads handling updates concurrently
+    bot_workers: int = 8
+
+    # Database connection pool (ignored for SQLite). When no pool size is
+    # given it becomes bot_workers + 2: a connection for each dispatcher
+    # worker, plus the reminder scheduler and job queue threads.
+    db_pool_size: Optional[int] = None
+    db_max_overflow: int = 10
+    db_pool_timeout: int = 30
+    db_pool_recycle: int = 1800
+
+    # Reminder settings
+    reminder_start_hour: int = 8
+    reminder_end_hour: int = 20
+    reminder_interval_days: int = 2
+
+    def __post_init__(self):
+        """
+        Validate configuration settings.
+
+        Raises:
+            ValueError: If any setting is missing or out of range
+        """
+        if self.db_pool_size is None:
+            # Frozen dataclass: derive the default in place
+            object.__setattr__(self, "db_pool_size", self.bot_workers + 2)
+
         if not self.bot_token or self.bot_token == "PASTE_YOUR_TOKEN_HERE":
-            return False
-        
+            raise ValueError("TELEGRAM_BOT_TOKEN is not set")
+
         if not self.database_url:
-            return False
-        
+            raise ValueError("DATABASE_URL is not set")
+
+        if self.bot_workers < 1:
+            raise ValueError("BOT_WORKERS must be at least 1")
+
+        if self.db_pool_size < 1:
+            raise ValueError("DB_POOL_SIZE must be at least 1")
+
+        if self.db_max_overflow < 0:
+            raise ValueError("DB_MAX_OVERFLOW must not be negative")
+
+        if self.db_pool_timeout < 1:
+            raise ValueError("DB_POOL_TIMEOUT must be at least 1")
+
+        if self.db_pool_recycle < 1 and self.db_pool_recycle != -1:
+            raise ValueError("DB_POOL_RECYCLE must be at least 1, or -1 to disable recycling")
+
         if self.reminder_start_hour < 0 or self.reminder_start_hour > 23:
-            return False
-        
+            raise ValueError("REMINDER_START_HOUR must be between 0 and 23")
+
         if self.reminder_end_hour < 0 or self.reminder_end_hour > 23:
-            return False
-        
+            raise ValueError("REMINDER_END_HOUR must be between 0 and 23")
+
         if self.reminder_start_hour >= self.reminder_end_hour:
-            return False
-        
-        return True
-        
+            raise ValueError("REMINDER_START_HOUR must be before REMINDER_END_HOUR")
+
+        if self.reminder_interval_days < 1:
+            raise ValueError("REMINDER_INTERVAL_DAYS must be at least 1")
+
+    @classmethod
+    def from_env(cls) -> "Config":
+        """
+        Create a validated configuration from environment variables.
+
+        Returns:
+            Config: Validated configuration
+
+        Raises:
+            ValueError: If a variable is not a number where one is expected,
+                or any setting is missing or out of range
+        """
+        db_pool_size = os.getenv("DB_POOL_SIZE")
+        return cls(
+            bot_token=os.getenv("TELEGRAM_BOT_TOKEN", "PASTE_YOUR_TOKEN_HERE"),
+            database_url=os.getenv("DATABASE_URL", ""),
+            bot_workers=int(os.getenv("BOT_WORKERS", "8")),
+            db_pool_size=int(db_pool_size) if db_pool_size else None,
+            db_max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "10")),
+            db_pool_timeout=int(os.getenv("DB_POOL_TIMEOUT", "30")),
+            db_pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "1800")),
+            reminder_start_hour=int(os.getenv("REMINDER_START_HOUR", "8")),
+            reminder_end_hour=int(os.getenv("REMINDER_END_HOUR", "20")),
+            reminder_interval_days=int(os.getenv("REMINDER_INTERVAL_DAYS", "2")),
+        )
@@ -5,19 +5,73 @@ Provides private note storage for each user using PostgreSQL.
 
 import os
 import logging
+import threading
 import time
-from datetime import datetime
-from typing import List, Optional
+from collections import OrderedDict
+from enum import IntEnum
+from typing import Callable, Dict, List, Optional, Tuple
 from functools import wraps
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text, Index, JSON
+from sqlalchemy import bindparam, create_engine, delete, desc, event, func, inspect, insert, select, text, tuple_, Column, BigInteger, Integer, SmallInteger, String, DateTime, Text, Index, JSON
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.types import TypeDecorator
 from sqlalchemy.exc import SQLAlchemyError, OperationalError, DisconnectionError
 
 logger = logging.getLogger(__name__)
 
 Base = declarative_base()
 
+# Number of recently saved (user_id, username, first_name, last_name) tuples
+# remembered so repeat messages from known users skip the user upsert
+USER_CACHE_SIZE = 10000
+
+# Seconds the bot-wide user and note totals are reused before re-querying
+STATS_CACHE_TTL = 60
+
+# Compiled SQL kept per engine. Statement shapes vary with optional
+# arguments, so leave headroom over the default of 500.
+QUERY_CACHE_SIZE = 1200
+
+# Version of the schema created by this code, stored in the meta table.
+# Bump it when the models or _upgrade_schema change, so existing databases
+# are brought up to date on their next start.
+SCHEMA_VERSION = 3
+
+# Indexes from older versions that the current Note indexes replace
+SUPERSEDED_INDEXES = ('idx_user_id', 'idx_notes_user_created', 'idx_notes_user_created_desc')
+
+# (table, column) pairs of the timestamp columns, for schema upgrades
+TIMESTAMP_COLUMNS = (
+    ('users', 'created_at'),
+    ('users', 'updated_at'),
+    ('notes', 'created_at'),
+    ('meta', 'updated_at'),
+)
+
+# Applied to every new SQLite connection: WAL lets readers run alongside the
+# single writer, and synchronous=NORMAL is safe under WAL with one fsync less
+# per commit.
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA busy_timeout=5000",
+)
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Configure a freshly opened SQLite connection."""
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute(pragma)
+    finally:
+        cursor.close()
+
 def retry_db_operation(max_retries=3, delay=1):
     """Decorator to retry database operations on connection failures."""
     def decorator(func):
@@ -28,74 +82,446 @@ def retry_db_operation(max_retries=3, delay=1):
                     return func(*args, **kwargs)
                 except (OperationalError, DisconnectionError) as e:
                     if attempt < max_retries - 1:
-                        logger.warning(f"Database operation failed (attempt {attempt + 1}/{max_retries}): {e}")
+                        logger.warning("Database operation failed (attempt %s/%s): %s", attempt + 1, max_retries, e)
                         time.sleep(delay * (2 ** attempt))  # Exponential backoff
                         continue
                     else:
-                        logger.error(f"Database operation failed after {max_retries} attempts: {e}")
+                        logger.error("Database operation failed after %s attempts: %s", max_retries, e)
                         raise
                 except SQLAlchemyError as e:
-                    logger.error(f"Database error in {func.__name__}: {e}")
+                    logger.error("Database error in %s: %s", func.__name__, e)
                     raise
         return wrapper
     return decorator
 
+def cached_for(seconds: float, fallback: Callable[[], object]):
+    """
+    Decorator caching a no-argument method's result per instance for a while.
+    
+    For bot-wide aggregates that change slowly but scan whole tables. The
+    (value, expires_at) pair is swapped in with a single attribute write, so
+    no lock is needed; concurrent misses just run the query twice.
+    
+    Only results are cached: if the method raises SQLAlchemyError, the error
+    is logged and fallback() is returned, and the next call queries again.
+    """
+    def decorator(func):
+        attribute = f"_cached_{func.__name__}"
+        
+        @wraps(func)
+        def wrapper(self):
+            cached = getattr(self, attribute, None)
+            now = time.monotonic()
+            if cached is not None and cached[1] > now:
+                return cached[0]
+            
+            try:
+                value = func(self)
+            except SQLAlchemyError as e:
+                logger.error("Failed to %s: %s", func.__name__.replace('_', ' '), e)
+                return fallback()
+            
+            setattr(self, attribute, (value, now + seconds))
+            return value
+        return wrapper
+    return decorator
+
+class NoteType(IntEnum):
+    """Kinds of notes, stored as small integers."""
+    TEXT = 1
+    IMAGE = 2
+    VOICE = 3
+    DOCUMENT = 4
+    VIDEO = 5
+    AUDIO = 6
+
+class NoteTypeColumn(TypeDecorator):
+    """
+    Column storing note type names ('text', 'image', ...) as NoteType values.
+    
+    A SMALLINT per row instead of a repeated string keeps the notes table
+    and its indexes smaller, while the storage API keeps using names.
+    """
+    impl = SmallInteger
+    cache_ok = True
+    
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return int(NoteType[value.upper()])
+    
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        # int() also accepts rows SQLite kept as text after the migration
+        return NoteType(int(value)).name.lower()
+
+# Timestamps are stamped by the database clock in the INSERT/UPDATE itself
+# rather than by each bot process. default= covers tables created before
+# the server default existed (SQLite cannot add one to an existing column).
+def _timestamp_column(updated: bool = False) -> Column:
+    """Create a timezone-aware column defaulting to the database's now()."""
+    return Column(
+        DateTime(timezone=True),
+        default=func.now(),
+        server_default=func.now(),
+        onupdate=func.now() if updated else None
+    )
+
 class User(Base):
     """User table to store basic user information."""
     __tablename__ = 'users'
     
-    user_id = Column(String, primary_key=True)  # Telegram user ID
+    user_id = Column(BigInteger, primary_key=True, autoincrement=False)  # Telegram user ID
     username = Column(String, nullable=True)    # Telegram username
     first_name = Column(String, nullable=True)  # User's first name
     last_name = Column(String, nullable=True)   # User's last name
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = _timestamp_column()
+    updated_at = _timestamp_column(updated=True)
 
 class Note(Base):
     """Note table to store user notes privately."""
     __tablename__ = 'notes'
     
     id = Column(Integer, primary_key=True, autoincrement=True)
-    user_id = Column(String, nullable=False)  # Links to User.user_id
+    user_id = Column(BigInteger, nullable=False)  # Links to User.user_id
     content = Column(Text, nullable=False)    # Note content (text, file paths, etc.)
-    note_type = Column(String, nullable=False, default='text')  # text, image, voice, document
-    note_metadata = Column(JSON, nullable=True)    # Additional metadata (file info, etc.)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    note_type = Column(NoteTypeColumn, nullable=False, default='text')  # text, image, voice, document, video, audio
+    # Additional metadata (file info, etc.); binary JSONB on PostgreSQL so
+    # reads skip re-parsing JSON text
+    note_metadata = Column(JSON().with_variant(JSONB(), 'postgresql'), nullable=True)
+    created_at = _timestamp_column()
     
-    # Index for faster queries by user_id
-    __table_args__ = (Index('idx_user_id', 'user_id'),)
+    # (user_id, created_at DESC, id DESC) serves both lookups by user and
+    # "newest first" listings without a sort; id breaks ties between notes
+    # stamped with the same time (PostgreSQL's now() is fixed per
+    # transaction). On PostgreSQL it also covers note_type so those listings
+    # need no heap fetch. (user_id, id) serves deletes of a user's note by
+    # primary key.
+    __table_args__ = (
+        Index('idx_notes_user_created_id', 'user_id', desc('created_at'), desc('id'),
+              postgresql_include=['note_type']),
+        Index('idx_notes_user_id_pk', 'user_id', 'id'),
+    )
+
+class Meta(Base):
+    """Key/value table for bot-wide state that must survive restarts."""
+    __tablename__ = 'meta'
+    
+    key = Column(String, primary_key=True)
+    value = Column(Text, nullable=True)
+    updated_at = _timestamp_column(updated=True)
+
+# Columns read for notes returned with metadata. Selecting columns yields
+# plain rows instead of tracked ORM objects, which read-only callers don't need.
+_NOTE_COLUMNS = (Note.id, Note.content, Note.note_type, Note.note_metadata, Note.created_at)
+
+def _note_to_dict(note) -> dict:
+    """Convert a note row to the dict format returned by the storage API."""
+    return {
+        'id': note.id,
+        'content': note.content,
+        'note_type': note.note_type,
+        'metadata': note.note_metadata or {},
+        'created_at': note.created_at
+    }
+
+# Statements run on every message or menu page. They are built once with
+# bind parameters, so each call reuses the same compiled SQL from the
+# engine's cache instead of rebuilding and re-keying the statement.
+_SELECT_NOTES_PAGE = select(
+    Note.id,
+    func.substr(Note.content, 1, bindparam('preview_length')),
+    func.count().over()
+).where(
+    Note.user_id == bindparam('user_id')
+).order_by(Note.created_at.desc(), Note.id.desc()).offset(bindparam('offset')).limit(bindparam('limit'))
+
+_COUNT_NOTES = select(func.count()).select_from(Note).where(Note.user_id == bindparam('user_id'))
+
+# Keyset pages: notes listed after or before a given note in the newest
+# first order, found through the (user_id, created_at, id) index instead of
+# skipping OFFSET rows. The cursor note's created_at is read in the query,
+# so it is compared exactly as stored, and id breaks ties between notes
+# saved in the same second.
+_NOTE_KEY = tuple_(Note.created_at, Note.id)
+_CURSOR_KEY = tuple_(
+    select(Note.created_at).where(
+        Note.id == bindparam('cursor_id'),
+        Note.user_id == bindparam('user_id')
+    ).scalar_subquery(),
+    bindparam('cursor_id', type_=Integer)
+)
+_SELECT_NOTES_AFTER = select(
+    Note.id,
+    func.substr(Note.content, 1, bindparam('preview_length')),
+    _COUNT_NOTES.scalar_subquery()
+).where(
+    Note.user_id == bindparam('user_id'),
+    _NOTE_KEY < _CURSOR_KEY
+).order_by(Note.created_at.desc(), Note.id.desc()).limit(bindparam('limit'))
+# Read oldest first, then reversed into page order
+_SELECT_NOTES_BEFORE = select(
+    Note.id,
+    func.substr(Note.content, 1, bindparam('preview_length')),
+    _COUNT_NOTES.scalar_subquery()
+).where(
+    Note.user_id == bindparam('user_id'),
+    _NOTE_KEY > _CURSOR_KEY
+).order_by(Note.created_at, Note.id).limit(bindparam('limit'))
 
 class DatabaseStorage:
     """Database storage for multi-user note management."""
     
-    def __init__(self, database_url: str):
-        """Initialize database connection with resilient settings."""
-        self.engine = create_engine(
-            database_url,
-            pool_pre_ping=True,        # Test connections before using
-            pool_recycle=300,          # Recycle connections every 5 minutes
-            pool_size=10,              # Connection pool size
-            max_overflow=20,           # Additional connections allowed
-            connect_args={
-                "connect_timeout": 10,  # Connection timeout
-                "application_name": "telegram_notes_bot"
-            }
+    def __init__(self, database_url: str, pool_size: int = 10, max_overflow: int = 10,
+                 pool_timeout: int = 30, pool_recycle: int = 1800):
+        """
+        Initialize database connection with resilient settings.
+        
+        Args:
+            database_url: SQLAlchemy database URL
+            pool_size: Connections kept open in the pool; size this to the
+                number of threads that query the database at the same time
+            max_overflow: Extra connections allowed during bursts; keep
+                pool_size + max_overflow well below the server's
+                max_connections
+            pool_timeout: Seconds to wait for a free connection before failing
+            pool_recycle: Seconds after which a connection is replaced
+        """
+        url = make_url(database_url)
+        if url.drivername in ('postgres', 'postgresql'):
+            # Hosting providers hand out postgres:// URLs, which SQLAlchemy no
+            # longer accepts, and newer SQLAlchemy releases default to
+            # psycopg 3. Use the psycopg2 driver this bot ships with unless the
+            # URL names another one (e.g. postgresql+psycopg://).
+            url = url.set(drivername='postgresql+psycopg2')
+        
+        if url.get_backend_name() == 'sqlite':
+            # Handlers run on several worker threads and share the pool
+            self.engine = create_engine(
+                url,
+                pool_pre_ping=True,
+                query_cache_size=QUERY_CACHE_SIZE,
+                connect_args={
+                    "check_same_thread": False,
+                    "cached_statements": 256  # Reuse prepared statements per connection
+                }
+            )
+            event.listen(self.engine, "connect", _set_sqlite_pragmas)
+        else:
+            driver_options = {}
+            if url.get_driver_name() == 'psycopg2':
+                # Send bulk INSERTs as multi-row VALUES pages and batch other
+                # executemany statements, instead of one round trip per row
+                driver_options["executemany_mode"] = "values_plus_batch"
+            self.engine = create_engine(
+                url,
+                pool_pre_ping=True,        # Test connections before using
+                pool_recycle=pool_recycle, # Replace long-lived connections
+                pool_size=pool_size,       # Connection pool size
+                max_overflow=max_overflow, # Additional connections allowed
+                pool_timeout=pool_timeout, # Wait for a free connection
+                query_cache_size=QUERY_CACHE_SIZE,
+                connect_args={
+                    "connect_timeout": 10,  # Connection timeout
+                    "application_name": "telegram_notes_bot"
+                },
+                **driver_options
+            )
+        # expire_on_commit=False keeps loaded attributes readable after commit
+        # without another round trip
+        self.SessionLocal = sessionmaker(
+            autocommit=False,
+            autoflush=False,
+            expire_on_commit=False,
+            bind=self.engine
+        )
+        # Reads run in autocommit mode: a single SELECT needs no transaction,
+        # which saves the BEGIN and the ROLLBACK when the connection goes
+        # back to the pool. The engine copy shares the same pool.
+        self.ReadSessionLocal = sessionmaker(
+            autoflush=False,
+            expire_on_commit=False,
+            bind=self.engine.execution_options(isolation_level="AUTOCOMMIT")
         )
-        self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
         
-        # Create tables
-        Base.metadata.create_all(bind=self.engine)
+        # LRU of user details already written to the users table
+        self._known_users: "OrderedDict[tuple, None]" = OrderedDict()
+        self._known_users_lock = threading.Lock()
+        
+        # Schema setup introspects every table and index, so it only runs
+        # when the stored version is behind; a normal start costs one query
+        schema_version = self._get_schema_version()
+        if schema_version is None or schema_version < SCHEMA_VERSION:
+            self._init_schema()
         logger.info("Database initialized successfully")
     
+    def _get_schema_version(self) -> Optional[int]:
+        """
+        Read the schema version recorded by _init_schema.
+        
+        Returns:
+            Optional[int]: Stored version, or None for a new database or one
+                created before versions were recorded
+        """
+        try:
+            with self.engine.connect() as conn:
+                value = conn.execute(
+                    select(Meta.value).where(Meta.key == 'schema_version')
+                ).scalar()
+        except SQLAlchemyError:
+            # No meta table yet
+            return None
+        return int(value) if value is not None else None
+    
+    def _init_schema(self):
+        """Create missing tables and indexes, apply upgrades and record the version."""
+        # Create tables, plus any indexes added since the tables were created
+        Base.metadata.create_all(bind=self.engine)
+        self._upgrade_schema()
+        for index in Note.__table__.indexes:
+            index.create(bind=self.engine, checkfirst=True)
+        
+        with self.engine.begin() as conn:
+            conn.execute(delete(Meta).where(Meta.key == 'schema_version'))
+            conn.execute(insert(Meta).values(key='schema_version', value=str(SCHEMA_VERSION)))
+        logger.info("Database schema set up (version %s)", SCHEMA_VERSION)
+    
+    def _upgrade_schema(self):
+        """
+        Bring tables created by older versions up to the current model.
+        
+        create_all() only creates missing tables and indexes, so indexes
+        that were replaced are dropped here, and column changes to existing
+        PostgreSQL tables are applied. SQLite cannot change column types;
+        it stores the old text IDs with type affinity and compares them with
+        integers transparently, so only the note type values are rewritten.
+        """
+        inspector = inspect(self.engine)
+        is_postgresql = self.engine.dialect.name == 'postgresql'
+        
+        existing_indexes = {index['name'] for index in inspector.get_indexes('notes')}
+        note_columns = {column['name']: column['type'] for column in inspector.get_columns('notes')}
+        with self.engine.begin() as conn:
+            for name in SUPERSEDED_INDEXES:
+                if name in existing_indexes:
+                    logger.info("Dropping superseded index %s", name)
+                    conn.execute(text(f"DROP INDEX {name}"))
+            
+            # Note types used to be stored as their names
+            if note_columns['note_type'].python_type is not int:
+                logger.info("Converting notes.note_type to SMALLINT")
+                note_type_case = "CASE note_type {} ELSE {} END".format(
+                    " ".join(f"WHEN '{note_type.name.lower()}' THEN {note_type.value}" for note_type in NoteType),
+                    NoteType.TEXT.value
+                )
+                if is_postgresql:
+                    conn.execute(text(
+                        f"ALTER TABLE notes ALTER COLUMN note_type TYPE SMALLINT USING {note_type_case}"
+                    ))
+                else:
+                    # The column stays text in SQLite, so skip values that
+                    # are already numbers in case this runs again
+                    conn.execute(text(
+                        f"UPDATE notes SET note_type = {note_type_case} WHERE note_type NOT GLOB '[0-9]*'"
+                    ))
+        
+        if not is_postgresql:
+            return
+        
+        with self.engine.begin() as conn:
+            # Telegram user IDs used to be stored as text
+            for table in ('users', 'notes'):
+                columns = {column['name']: column['type'] for column in inspector.get_columns(table)}
+                if columns['user_id'].python_type is not int:
+                    logger.info("Converting %s.user_id to BIGINT", table)
+                    conn.execute(text(
+                        f"ALTER TABLE {table} ALTER COLUMN user_id TYPE BIGINT USING user_id::bigint"
+                    ))
+            
+            # Note metadata used to be stored as plain JSON text
+            if not isinstance(note_columns['note_metadata'], JSONB):
+                logger.info("Converting notes.note_metadata to JSONB")
+                conn.execute(text(
+                    "ALTER TABLE notes ALTER COLUMN note_metadata TYPE JSONB USING note_metadata::jsonb"
+                ))
+            
+            # Timestamps used to be naive UTC values set by the bot
+            for table, column in TIMESTAMP_COLUMNS:
+                column_types = {info['name']: info['type'] for info in inspector.get_columns(table)}
+                if not getattr(column_types[column], 'timezone', False):
+                    logger.info("Converting %s.%s to TIMESTAMPTZ", table, column)
+                    conn.execute(text(
+                        f"ALTER TABLE {table} ALTER COLUMN {column} TYPE TIMESTAMPTZ "
+                        f"USING {column} AT TIME ZONE 'UTC', ALTER COLUMN {column} SET DEFAULT now()"
+                    ))
+    
     def get_session(self) -> Session:
-        """Get database session."""
+        """Get a database session; use it as a context manager so it is always closed."""
         return self.SessionLocal()
     
+    def get_pool_status(self) -> str:
+        """
+        Describe the connection pool's current usage.
+        
+        Returns:
+            str: Pool size, checked-in/out and overflow connection counts
+        """
+        return self.engine.pool.status()
+    
+    def get_read_session(self) -> Session:
+        """Get an autocommit session for read-only queries; use it as a context manager."""
+        return self.ReadSessionLocal()
+    
+    def _is_known_user(self, user_key: tuple) -> bool:
+        """Check whether these exact user details were already saved."""
+        with self._known_users_lock:
+            if user_key in self._known_users:
+                self._known_users.move_to_end(user_key)
+                return True
+            return False
+    
+    def _remember_user(self, user_key: tuple):
+        """Record saved user details, evicting the least recently used entry."""
+        with self._known_users_lock:
+            self._known_users[user_key] = None
+            self._known_users.move_to_end(user_key)
+            if len(self._known_users) > USER_CACHE_SIZE:
+                self._known_users.popitem(last=False)
+    
+    def _upsert_user(self, session: Session, user_id: int, username: str = None,
+                     first_name: str = None, last_name: str = None):
+        """
+        Insert or update a user row within the given session (no commit).
+        
+        A single INSERT ... ON CONFLICT DO UPDATE, so concurrent first
+        messages from a new user cannot both try to insert the row.
+        """
+        dialect_insert = postgresql.insert if self.engine.dialect.name == 'postgresql' else sqlite.insert
+        stmt = dialect_insert(User).values(
+            user_id=user_id,
+            username=username,
+            first_name=first_name,
+            last_name=last_name
+        )
+        session.execute(stmt.on_conflict_do_update(
+            index_elements=[User.user_id],
+            set_={
+                'username': stmt.excluded.username,
+                'first_name': stmt.excluded.first_name,
+                'last_name': stmt.excluded.last_name,
+                'updated_at': func.now()
+            }
+        ))
+    
     @retry_db_operation(max_retries=3, delay=1)
-    def save_user(self, user_id: str, username: str = None, first_name: str = None, last_name: str = None) -> bool:
+    def save_user(self, user_id: int, username: str = None, first_name: str = None, last_name: str = None) -> bool:
         """
         Save or update user information.
         
+        Skipped without touching the database when the same details were
+        saved recently.
+        
         Args:
             user_id: Telegram user ID
             username: Telegram username
@@ -105,41 +531,25 @@ class DatabaseStorage:
         Returns:
             bool: True if successful, False otherwise
         """
-        try:
-            session = self.get_session()
-            
-            # Check if user exists
-            user = session.query(User).filter(User.user_id == user_id).first()
-            
-            if user:
-                # Update existing user
-                user.username = username
-                user.first_name = first_name
-                user.last_name = last_name
-                user.updated_at = datetime.utcnow()
-            else:
-                # Create new user
-                user = User(
-                    user_id=user_id,
-                    username=username,
-                    first_name=first_name,
-                    last_name=last_name
-                )
-                session.add(user)
-            
-            session.commit()
-            logger.info(f"User saved: {user_id}")
+        user_key = (user_id, username, first_name, last_name)
+        if self._is_known_user(user_key):
             return True
-            
-        except SQLAlchemyError as e:
-            logger.error(f"Failed to save user {user_id}: {e}")
-            session.rollback()
-            return False
-        finally:
-            session.close()
+        
+        with self.get_session() as session:
+            try:
+                self._upsert_user(session, user_id, username, first_name, last_name)
+                
+                session.commit()
+                self._remember_user(user_key)
+                logger.info("User saved: %s", user_id)
+                return True
+                
+            except SQLAlchemyError as e:
+                logger.error("Failed to save user %s: %s", user_id, e)
+                return False
     
     @retry_db_operation(max_retries=3, delay=1)
-    def save_note(self, user_id: str, content: str, note_type: str = 'text', note_metadata: dict = None) -> bool:
+    def save_note(self, user_id: int, content: str, note_type: str = 'text', note_metadata: dict = None) -> bool:
         """
         Save a note for a specific user.
         
@@ -152,54 +562,168 @@ class DatabaseStorage:
         Returns:
             bool: True if successful, False otherwise
         """
-        try:
-            session = self.get_session()
+        with self.get_session() as session:
+            try:
+                note = Note(
+                    user_id=user_id, 
+                    content=content.strip() if note_type == 'text' else content,
+                    note_type=note_type,
+                    note_metadata=note_metadata or {}
+                )
+                session.add(note)
+                session.commit()
+                
+                logger.info("Note saved for user %s (type: %s): %s...", user_id, note_type, content[:50])
+                return True
+                
+            except SQLAlchemyError as e:
+                logger.error("Failed to save note for user %s: %s", user_id, e)
+                return False
+    
+    @retry_db_operation(max_retries=3, delay=1)
+    def save_message(self, user_id: int, content: str, note_type: str = 'text', note_metadata: dict = None,
+                     username: str = None, first_name: str = None, last_name: str = None) -> bool:
+        """
+        Save/update the sender and store their note in a single transaction.
+        
+        Used by the message handlers so each incoming update costs one commit
+        instead of separate save_user and save_note commits.
+        The user upsert is skipped when the same details were saved recently.
+        
+        Args:
+            user_id: Telegram user ID
+            content: Note content
+            note_type: Type of note (text, image, voice, document, video, audio)
+            note_metadata: Additional metadata about the note
+            username: Telegram username
+            first_name: User's first name
+            last_name: User's last name
             
-            note = Note(
-                user_id=user_id, 
-                content=content.strip() if note_type == 'text' else content,
-                note_type=note_type,
-                note_metadata=note_metadata or {}
-            )
-            session.add(note)
-            session.commit()
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        user_key = (user_id, username, first_name, last_name)
+        user_known = self._is_known_user(user_key)
+        
+        with self.get_session() as session:
+            try:
+                if not user_known:
+                    self._upsert_user(session, user_id, username, first_name, last_name)
+                session.add(Note(
+                    user_id=user_id,
+                    content=content.strip() if note_type == 'text' else content,
+                    note_type=note_type,
+                    note_metadata=note_metadata or {}
+                ))
+                session.commit()
+                if not user_known:
+                    self._remember_user(user_key)
+                
+                logger.info("Message saved for user %s (type: %s): %s...", user_id, note_type, content[:50])
+                return True
+                
+            except SQLAlchemyError as e:
+                logger.error("Failed to save message for user %s: %s", user_id, e)
+                return False
+    
+    @retry_db_operation(max_retries=3, delay=1)
+    def save_notes_bulk(self, user_id: int, records: List[dict]) -> bool:
+        """
+        Save several notes for a user in one transaction.
+        
+        All rows go to the database as a single executemany INSERT with one
+        commit, rather than one round trip and commit per note.
+        
+        Args:
+            user_id: Telegram user ID
+            records: Notes to save, each a dict with 'content' and optional
+                'note_type' (default 'text') and 'note_metadata'
             
-            logger.info(f"Note saved for user {user_id} (type: {note_type}): {content[:50]}...")
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        if not records:
             return True
-            
-        except SQLAlchemyError as e:
-            logger.error(f"Failed to save note for user {user_id}: {e}")
-            session.rollback()
-            return False
-        finally:
-            session.close()
+        
+        rows = []
+        for record in records:
+            note_type = record.get('note_type', 'text')
+            content = record['content']
+            rows.append({
+                'user_id': user_id,
+                'content': content.strip() if note_type == 'text' else content,
+                'note_type': note_type,
+                'note_metadata': record.get('note_metadata') or {}
+            })
+        
+        with self.get_session() as session:
+            try:
+                session.execute(insert(Note), rows)
+                session.commit()
+                
+                logger.info("%s notes saved for user %s", len(rows), user_id)
+                return True
+                
+            except SQLAlchemyError as e:
+                logger.error("Failed to save %s notes for user %s: %s", len(rows), user_id, e)
+                return False
     
     @retry_db_operation(max_retries=3, delay=1)
-    def get_notes(self, user_id: str) -> List[str]:
+    def get_notes_page(self, user_id: int, offset: int = 0, limit: int = 10,
+                       preview_length: int = 60, after_id: Optional[int] = None,
+                       before_id: Optional[int] = None) -> Tuple[List[Tuple[int, str]], int]:
         """
-        Get all notes for a specific user.
+        Get one page of a user's notes for listing, with the total count.
+        
+        Only the requested rows are read, content is cut to preview_length
+        characters in the database, and the total comes from the same
+        query, so a page costs one round trip.
+        
+        Pages next to one already shown should pass after_id or before_id
+        instead of an offset: the page is then found through the index
+        from that note, however deep it is, rather than by skipping rows.
         
         Args:
             user_id: Telegram user ID
+            offset: Number of notes to skip (newest first); ignored when
+                after_id or before_id is given
+            limit: Maximum number of notes to return
+            preview_length: Maximum content characters to return per note
+            after_id: Return the notes listed right after this note
+            before_id: Return the notes listed right before this note
             
         Returns:
-            List[str]: List of user's notes
+            Tuple[List[Tuple[int, str]], int]: (note id, content preview)
+                pairs and the user's total number of notes. The total is 0
+                when the page is empty, including an offset past the end or
+                a cursor note that no longer exists.
         """
-        try:
-            session = self.get_session()
-            
-            notes = session.query(Note).filter(Note.user_id == user_id).order_by(Note.created_at.desc()).all()
-            
-            return [note.content for note in notes]
-            
-        except SQLAlchemyError as e:
-            logger.error(f"Failed to get notes for user {user_id}: {e}")
-            return []
-        finally:
-            session.close()
+        params = {'user_id': user_id, 'preview_length': preview_length, 'limit': limit}
+        if after_id is not None:
+            statement = _SELECT_NOTES_AFTER
+            params['cursor_id'] = after_id
+        elif before_id is not None:
+            statement = _SELECT_NOTES_BEFORE
+            params['cursor_id'] = before_id
+        else:
+            statement = _SELECT_NOTES_PAGE
+            params['offset'] = offset
+        
+        with self.get_read_session() as session:
+            try:
+                notes = session.execute(statement, params).all()
+                if before_id is not None and after_id is None:
+                    notes.reverse()
+                
+                total = notes[0][2] if notes else 0
+                return [(note_id, preview) for note_id, preview, _ in notes], total
+                
+            except SQLAlchemyError as e:
+                logger.error("Failed to get notes page for user %s: %s", user_id, e)
+                return [], 0
     
     @retry_db_operation(max_retries=3, delay=1)
-    def get_notes_with_metadata(self, user_id: str) -> List[dict]:
+    def get_notes_with_metadata(self, user_id: int) -> List[dict]:
         """
         Get all notes for a specific user with metadata.
         
@@ -209,29 +733,81 @@ class DatabaseStorage:
         Returns:
             List[dict]: List of notes with metadata
         """
-        try:
-            session = self.get_session()
+        with self.get_read_session() as session:
+            try:
+                notes = session.execute(
+                    select(*_NOTE_COLUMNS).where(Note.user_id == user_id).order_by(
+                        Note.created_at.desc(), Note.id.desc()
+                    )
+                ).all()
+                return [_note_to_dict(note) for note in notes]
+                
+            except SQLAlchemyError as e:
+                logger.error("Failed to get notes with metadata for user %s: %s", user_id, e)
+                return []
+    
+    @retry_db_operation(max_retries=3, delay=1)
+    def get_random_note(self, user_id: int) -> Optional[dict]:
+        """
+        Get one randomly chosen note of a user with metadata.
+        
+        The pick happens in the database, so only one row is transferred
+        however many notes the user has.
+        
+        Args:
+            user_id: Telegram user ID
             
-            notes = session.query(Note).filter(Note.user_id == user_id).order_by(Note.created_at.desc()).all()
-            return [
-                {
-                    'id': note.id,
-                    'content': note.content,
-                    'note_type': note.note_type,
-                    'metadata': note.note_metadata or {},
-                    'created_at': note.created_at
-                }
-                for note in notes
-            ]
+        Returns:
+            Optional[dict]: Note in the same format as get_notes_with_metadata,
+                or None if the user has no notes
+        """
+        with self.get_read_session() as session:
+            try:
+                note = session.execute(
+                    select(*_NOTE_COLUMNS).where(Note.user_id == user_id).order_by(func.random()).limit(1)
+                ).first()
+                return _note_to_dict(note) if note else None
+                
+            except SQLAlchemyError as e:
+                logger.error("Failed to get random note for user %s: %s", user_id, e)
+                return None
+    
+    @retry_db_operation(max_retries=3, delay=1)
+    def get_random_notes_by_users(self, user_ids: List[int]) -> Dict[int, dict]:
+        """
+        Get one randomly chosen note for each of several users in one query.
+        
+        Used when reminders for many users are due together: a window
+        function picks each user's note in the database, so one row per
+        user is transferred instead of all of their notes.
+        
+        Args:
+            user_ids: Telegram user IDs
             
-        except SQLAlchemyError as e:
-            logger.error(f"Failed to get notes with metadata for user {user_id}: {e}")
-            return []
-        finally:
-            session.close()
+        Returns:
+            Dict[int, dict]: Note per user, in the same format as
+                get_notes_with_metadata. Users without notes are left out.
+        """
+        if not user_ids:
+            return {}
+        
+        with self.get_read_session() as session:
+            try:
+                ranked = select(
+                    Note.user_id,
+                    *_NOTE_COLUMNS,
+                    func.row_number().over(partition_by=Note.user_id, order_by=func.random()).label('pick')
+                ).where(Note.user_id.in_(user_ids)).subquery()
+                
+                notes = session.execute(select(ranked).where(ranked.c.pick == 1)).all()
+                return {note.user_id: _note_to_dict(note) for note in notes}
+                
+            except SQLAlchemyError as e:
+                logger.error("Failed to get random notes for %s users: %s", len(user_ids), e)
+                return {}
     
     @retry_db_operation(max_retries=3, delay=1)
-    def get_notes_count(self, user_id: str) -> int:
+    def get_notes_count(self, user_id: int) -> int:
         """
         Get the total number of notes for a specific user.
         
@@ -241,57 +817,51 @@ class DatabaseStorage:
         Returns:
             int: Number of notes
         """
-        try:
-            session = self.get_session()
-            
-            count = session.query(Note).filter(Note.user_id == user_id).count()
-            return count
-            
-        except SQLAlchemyError as e:
-            logger.error(f"Failed to get notes count for user {user_id}: {e}")
-            return 0
-        finally:
-            session.close()
+        with self.get_read_session() as session:
+            try:
+                return session.scalar(_COUNT_NOTES, {'user_id': user_id})
+                
+            except SQLAlchemyError as e:
+                logger.error("Failed to get notes count for user %s: %s", user_id, e)
+                return 0
     
     @retry_db_operation(max_retries=3, delay=1)
-    def delete_note_by_index(self, user_id: str, index: int) -> bool:
+    def delete_note_by_id(self, user_id: int, note_id: int) -> bool:
         """
-        Delete a specific note by its index for a user.
+        Delete a specific note by its primary key.
+        
+        A primary-key lookup, so the cost does not grow with the number of
+        notes, and a note added or removed since the /clear menu was shown
+        cannot shift the target. The user_id filter keeps users from
+        deleting each other's notes.
         
         Args:
             user_id: Telegram user ID
-            index: Index of the note to delete (0-based)
+            note_id: Primary key of the note to delete
             
         Returns:
-            bool: True if successful, False otherwise
+            bool: True if a note was deleted, False otherwise
         """
-        try:
-            session = self.get_session()
-            
-            # Get notes ordered by creation date (newest first)
-            notes = session.query(Note).filter(Note.user_id == user_id).order_by(Note.created_at.desc()).all()
-            
-            if not notes or index < 0 or index >= len(notes):
-                logger.error(f"Invalid note index {index} for user {user_id}, total notes: {len(notes)}")
+        with self.get_session() as session:
+            try:
+                deleted_count = session.execute(
+                    delete(Note).where(Note.id == note_id, Note.user_id == user_id)
+                ).rowcount
+                session.commit()
+                
+                if not deleted_count:
+                    logger.error("Note %s not found for user %s", note_id, user_id)
+                    return False
+                
+                logger.info("Note %s deleted for user %s", note_id, user_id)
+                return True
+                
+            except SQLAlchemyError as e:
+                logger.error("Failed to delete note %s for user %s: %s", note_id, user_id, e)
                 return False
-            
-            # Delete the note at the specified index
-            note_to_delete = notes[index]
-            session.delete(note_to_delete)
-            session.commit()
-            
-            logger.info(f"Note deleted for user {user_id} at index {index}: {note_to_delete.content[:50]}...")
-            return True
-            
-        except SQLAlchemyError as e:
-            logger.error(f"Failed to delete note for user {user_id} at index {index}: {e}")
-            session.rollback()
-            return False
-        finally:
-            session.close()
     
     @retry_db_operation(max_retries=3, delay=1)
-    def clear_notes(self, user_id: str) -> bool:
+    def clear_notes(self, user_id: int) -> bool:
         """
         Clear all notes for a specific user.
         
@@ -301,78 +871,97 @@ class DatabaseStorage:
         Returns:
             bool: True if successful, False otherwise
         """
-        try:
-            session = self.get_session()
-            
-            # Delete all notes for this user
-            deleted_count = session.query(Note).filter(Note.user_id == user_id).delete()
-            session.commit()
+        with self.get_session() as session:
+            try:
+                # Delete all notes for this user
+                deleted_count = session.execute(delete(Note).where(Note.user_id == user_id)).rowcount
+                session.commit()
+                
+                logger.info("All notes cleared for user %s (%s notes deleted)", user_id, deleted_count)
+                return True
+                
+            except SQLAlchemyError as e:
+                logger.error("Failed to clear notes for user %s: %s", user_id, e)
+                return False
+    
+    @retry_db_operation(max_retries=3, delay=1)
+    def get_meta(self, key: str) -> Optional[str]:
+        """
+        Get a bot-wide state value.
+        
+        Args:
+            key: Name of the value
             
-            logger.info(f"All notes cleared for user {user_id} ({deleted_count} notes deleted)")
-            return True
+        Returns:
+            Optional[str]: Stored value, or None if not set
+        """
+        with self.get_read_session() as session:
+            try:
+                entry = session.get(Meta, key)
+                return entry.value if entry else None
+                
+            except SQLAlchemyError as e:
+                logger.error("Failed to get meta value %s: %s", key, e)
+                return None
+    
+    @retry_db_operation(max_retries=3, delay=1)
+    def set_meta(self, key: str, value: str) -> bool:
+        """
+        Store a bot-wide state value, replacing any previous one.
+        
+        Args:
+            key: Name of the value
+            value: Value to store
             
-        except SQLAlchemyError as e:
-            logger.error(f"Failed to clear notes for user {user_id}: {e}")
-            session.rollback()
-            return False
-        finally:
-            session.close()
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        with self.get_session() as session:
+            try:
+                session.merge(Meta(key=key, value=value))
+                session.commit()
+                return True
+                
+            except SQLAlchemyError as e:
+                logger.error("Failed to set meta value %s: %s", key, e)
+                return False
     
-    def get_all_user_ids(self) -> List[str]:
+    @cached_for(STATS_CACHE_TTL, fallback=list)
+    def get_all_user_ids(self) -> List[int]:
         """
         Get all user IDs who have notes (for reminder system).
         
+        Cached for STATS_CACHE_TTL seconds; empty on a database error.
+        
         Returns:
-            List[str]: List of user IDs
+            List[int]: List of user IDs
         """
-        try:
-            session = self.get_session()
-            
+        with self.get_read_session() as session:
             # Get distinct user IDs who have notes
-            user_ids = session.query(Note.user_id).distinct().all()
-            
-            return [user_id[0] for user_id in user_ids]
-            
-        except SQLAlchemyError as e:
-            logger.error(f"Failed to get user IDs: {e}")
-            return []
-        finally:
-            session.close()
+            return list(session.scalars(select(Note.user_id).distinct()))
     
+    @cached_for(STATS_CACHE_TTL, fallback=int)
     def get_total_users(self) -> int:
         """
         Get total number of users.
         
+        Cached for STATS_CACHE_TTL seconds; 0 on a database error.
+        
         Returns:
             int: Number of users
         """
-        try:
-            session = self.get_session()
-            
-            count = session.query(User).count()
-            return count
-            
-        except SQLAlchemyError as e:
-            logger.error(f"Failed to get total users: {e}")
-            return 0
-        finally:
-            session.close()
+        with self.get_read_session() as session:
+            return session.scalar(select(func.count()).select_from(User))
     
+    @cached_for(STATS_CACHE_TTL, fallback=int)
     def get_total_notes(self) -> int:
         """
         Get total number of notes across all users.
         
+        Cached for STATS_CACHE_TTL seconds; 0 on a database error.
+        
         Returns:
             int: Number of notes
         """
-        try:
-            session = self.get_session()
-            
-            count = session.query(Note).count()
-            return count
-            
-        except SQLAlchemyError as e:
-            logger.error(f"Failed to get total notes: {e}")
-            return 0
-        finally:
-            session.close()
+        with self.get_read_session() as session:
+            return session.scalar(select(func.count()).select_from(Note))
@@ -5,36 +5,71 @@ This bot collects user notes and sends random reminders on a scheduled basis.
 """
 
 import logging
+import queue
 import sys
 import time
-from bot import NotesBot
+from logging.handlers import QueueHandler, QueueListener
+from bot import NotesBot, create_storage
 from config import Config
 
-# Set up logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
 logger = logging.getLogger(__name__)
 
+def setup_logging() -> QueueListener:
+    """
+    Set up logging through a background queue.
+    
+    Handler and scheduler threads only put records on a queue; a listener
+    thread does the actual writing, so slow log output never blocks them.
+    
+    Returns:
+        QueueListener: Started listener; stop it on shutdown to flush logs
+    """
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(
+        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    ))
+    
+    log_queue = queue.SimpleQueue()
+    root_logger = logging.getLogger()
+    root_logger.setLevel(logging.INFO)
+    root_logger.addHandler(QueueHandler(log_queue))
+    
+    listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    return listener
+
 def main():
     """Main function to start the bot with auto-restart capability."""
+    log_listener = setup_logging()
+    try:
+        run_bot()
+    finally:
+        log_listener.stop()
+
+def run_bot():
+    """Run the bot, restarting it with exponential backoff after crashes."""
     max_retries = 10
     retry_delay = 30  # seconds
     
+    # Load and validate configuration
+    try:
+        config = Config.from_env()
+    except ValueError as e:
+        logger.error("Configuration validation failed: %s. Please check your environment variables.", e)
+        sys.exit(1)
+    
+    # Created once and shared by every restart, so the schema setup and
+    # the warmed-up connection pool survive a bot crash
+    storage = None
+    
     for attempt in range(max_retries):
         try:
-            # Load configuration
-            config = Config()
-            
-            # Validate configuration
-            if not config.validate():
-                logger.error("Configuration validation failed. Please check your environment variables.")
-                sys.exit(1)
+            if storage is None:
+                storage = create_storage(config)
             
             # Create and start the bot
-            bot = NotesBot(config)
-            logger.info(f"Starting Telegram Notes Reminder Bot (attempt {attempt + 1}/{max_retries})...")
+            bot = NotesBot(config, storage=storage)
+            logger.info("Starting Telegram Notes Reminder Bot (attempt %s/%s)...", attempt + 1, max_retries)
             bot.start()
             
             # If we reach here, the bot stopped normally
@@ -45,10 +80,10 @@ def main():
             logger.info("Bot stopped by user")
             break
         except Exception as e:
-            logger.error(f"Bot crashed with error: {e}")
+            logger.error("Bot crashed with error: %s", e)
             
             if attempt < max_retries - 1:
-                logger.info(f"Restarting in {retry_delay} seconds... (attempt {attempt + 2}/{max_retries})")
+                logger.info("Restarting in %s seconds... (attempt %s/%s)", retry_delay, attempt + 2, max_retries)
                 time.sleep(retry_delay)
                 retry_delay = min(retry_delay * 2, 300)  # Exponential backoff, max 5 minutes
             else:
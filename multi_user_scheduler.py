@@ -3,21 +3,73 @@ Multi-user scheduler module for handling automatic reminder functionality.
 Manages reminders for all users with their private notes.
 """
 
+import heapq
+import json
 import threading
 import time
 import random
 import logging
-import os
-from datetime import datetime, timedelta
-from typing import Optional, Dict, List
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Optional, Dict, List, Set, Tuple
 import telegram
+from telegram.utils.request import Request
 from db_storage import DatabaseStorage
 
 logger = logging.getLogger(__name__)
 
+# Meta key holding the ISO date of the last reminder day whose reminders
+# were all sent, so the interval survives restarts
+LAST_REMINDER_DATE_KEY = 'last_reminder_date'
+
+# Meta key holding the users already handled on the current reminder day,
+# as JSON {"date": ISO date, "user_ids": [...]}, so a restart part way
+# through the day reminds only the rest
+REMINDED_USERS_KEY = 'reminded_users'
+
+# Reminder sends in flight at once. This bounds threads and connections,
+# not the send rate.
+REMINDER_SEND_CONCURRENCY = 25
+
+# Reminder sends started per second. Telegram allows about 30 messages per
+# second per bot; stay below it.
+REMINDER_SEND_RATE = 25
+
+class SendRateLimiter:
+    """
+    Spaces out calls so at most a given number start per second.
+    
+    Each caller reserves the next free slot under a lock, then sleeps until
+    it outside the lock, so waiting callers don't block each other.
+    """
+    
+    def __init__(self, per_second: float):
+        self._interval = 1.0 / per_second
+        self._lock = threading.Lock()
+        self._next_slot = time.monotonic()
+    
+    def wait(self):
+        """Block until the caller may start its call."""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self._interval
+        
+        if slot > now:
+            time.sleep(slot - now)
+
 class MultiUserScheduler:
     """Handles scheduled reminder functionality for multiple users."""
     
+    # note_type -> (Bot send method name, name of its file argument)
+    _MEDIA_SENDERS = {
+        'image': ('send_photo', 'photo'),
+        'voice': ('send_voice', 'voice'),
+        'document': ('send_document', 'document'),
+        'video': ('send_video', 'video'),
+        'audio': ('send_audio', 'audio'),
+    }
+    
     def __init__(self, bot_token: str, storage: DatabaseStorage, config):
         """
         Initialize the multi-user scheduler.
@@ -30,10 +82,24 @@ class MultiUserScheduler:
         self.bot_token = bot_token
         self.storage = storage
         self.config = config
-        self.bot = telegram.Bot(token=bot_token)
-        self._running = False
+        # Keep a pooled connection per concurrent send. The default pool of
+        # one makes parallel sends open, and then discard, new connections.
+        self.bot = telegram.Bot(
+            token=bot_token,
+            request=Request(con_pool_size=REMINDER_SEND_CONCURRENCY)
+        )
+        # Set while the scheduler is stopped; setting it wakes every sleeper
+        self._stop_event = threading.Event()
+        self._stop_event.set()
         self._thread: Optional[threading.Thread] = None
-        self._user_reminder_times: Dict[str, datetime] = {}
+        self._user_reminder_times: Dict[int, datetime] = {}
+        # Pending (send_time, user_id) reminders, earliest first. Only the
+        # scheduler thread touches it.
+        self._reminder_heap: List[Tuple[datetime, int]] = []
+        self._send_slots = threading.BoundedSemaphore(REMINDER_SEND_CONCURRENCY)
+        self._send_rate = SendRateLimiter(REMINDER_SEND_RATE)
+        # Reminders due at the same moment are sent in parallel on this pool
+        self._send_pool: Optional[ThreadPoolExecutor] = None
     
     def start(self):
         """Start the reminder scheduler in a background thread."""
@@ -41,41 +107,73 @@ class MultiUserScheduler:
             logger.warning("Scheduler is already running")
             return
         
-        self._running = True
+        # Anything left queued by a previous run is scheduled again, since
+        # its day was not recorded as done
+        self._reminder_heap.clear()
+        self._user_reminder_times.clear()
+        self._stop_event.clear()
+        self._send_pool = ThreadPoolExecutor(
+            max_workers=REMINDER_SEND_CONCURRENCY,
+            thread_name_prefix="reminder-send"
+        )
         self._thread = threading.Thread(target=self._run_scheduler, daemon=True)
         self._thread.start()
         logger.info("Multi-user reminder scheduler started")
     
     def stop(self):
         """Stop the reminder scheduler."""
-        self._running = False
+        self._stop_event.set()
         if self._thread and self._thread.is_alive():
             self._thread.join(timeout=5)
+        if self._send_pool:
+            self._send_pool.shutdown(wait=False, cancel_futures=True)
         logger.info("Multi-user reminder scheduler stopped")
     
+    @property
+    def _running(self) -> bool:
+        """Whether the scheduler has been started and not stopped."""
+        return not self._stop_event.is_set()
+    
     def _run_scheduler(self):
         """Main scheduler loop that runs in the background thread."""
         logger.info("Multi-user scheduler thread started")
         
         while self._running:
             try:
-                today = datetime.now().date()
+                next_reminder_date = self._next_reminder_date()
                 
-                # Check if today is a reminder day (every other day)
-                if today.day % self.config.reminder_interval_days == 0:
+                if next_reminder_date <= date.today():
                     self._handle_reminder_day()
                 else:
-                    logger.debug(f"Not a reminder day (day {today.day})")
-                    # Sleep for 1 hour and check again
-                    self._sleep_with_check(3600)
+                    # Sleep until the start of the next reminder day
+                    next_check = datetime.combine(next_reminder_date, datetime.min.time())
+                    logger.debug("Next reminder day is %s", next_reminder_date)
+                    self._sleep_with_check((next_check - datetime.now()).total_seconds())
             
             except Exception as e:
-                logger.error(f"Error in scheduler loop: {e}")
+                logger.error("Error in scheduler loop: %s", e)
                 # Sleep for 5 minutes before retrying
                 self._sleep_with_check(300)
     
+    def _next_reminder_date(self) -> date:
+        """
+        Get the next day reminders are due.
+        
+        Reminders are due reminder_interval_days after the last reminder
+        day, or today if there has been none.
+        
+        Returns:
+            date: Next reminder day; today or earlier means reminders are due
+        """
+        last_reminder_date = self.storage.get_meta(LAST_REMINDER_DATE_KEY)
+        if last_reminder_date is None:
+            return date.today()
+        return date.fromisoformat(last_reminder_date) + timedelta(days=self.config.reminder_interval_days)
+    
     def _handle_reminder_day(self):
         """Handle reminder logic for all users today."""
+        reminder_date = date.today()
+        
         # Get all users who have notes
         user_ids = self.storage.get_all_user_ids()
         
@@ -84,183 +182,192 @@ class MultiUserScheduler:
             self._sleep_with_check(3600)
             return
         
-        logger.info(f"Processing reminders for {len(user_ids)} users")
+        # After a restart part way through the day, skip users already handled
+        reminded = self._load_reminded_users(reminder_date)
+        pending_user_ids = [user_id for user_id in user_ids if user_id not in reminded]
+        logger.info("Processing reminders for %s users (%s already reminded today)",
+                    len(pending_user_ids), len(user_ids) - len(pending_user_ids))
         
-        # Schedule reminders for all users
-        for user_id in user_ids:
+        # Schedule reminders for the remaining users
+        for user_id in pending_user_ids:
             try:
                 self._schedule_user_reminder(user_id)
             except Exception as e:
-                logger.error(f"Failed to schedule reminder for user {user_id}: {e}")
+                logger.error("Failed to schedule reminder for user %s: %s", user_id, e)
         
-        # Sleep until next day
-        next_check = datetime.now().replace(
-            hour=0, minute=0, second=0, microsecond=0
-        ) + timedelta(days=1)
-        sleep_until_next_day = (next_check - datetime.now()).total_seconds()
-        self._sleep_with_check(sleep_until_next_day)
+        # Send them as they come due, recording each batch as it goes. The
+        # day itself is recorded only once the queue is empty; if the bot
+        # stops first, the next start resumes the day with the users not
+        # yet recorded. Only a batch cut off between sending and recording
+        # can be sent twice.
+        if self._run_due_reminders(reminder_date, reminded):
+            self.storage.set_meta(LAST_REMINDER_DATE_KEY, reminder_date.isoformat())
     
-    def _schedule_user_reminder(self, user_id: str):
-        """Schedule a reminder for a specific user."""
-        notes = self.storage.get_notes_with_metadata(user_id)
+    def _load_reminded_users(self, reminder_date: date) -> Set[int]:
+        """
+        Get the users already handled on a reminder day.
         
-        if not notes:
-            logger.debug(f"No notes found for user {user_id}, skipping reminder")
-            return
+        Args:
+            reminder_date: Reminder day
+            
+        Returns:
+            Set[int]: IDs of users recorded for that day; empty if the record
+                is for another day or missing
+        """
+        value = self.storage.get_meta(REMINDED_USERS_KEY)
+        if not value:
+            return set()
         
-        # Calculate random send time for this user
-        random_hour = random.randint(
-            self.config.reminder_start_hour, 
-            self.config.reminder_end_hour
-        )
-        random_minute = random.randint(0, 59)
+        try:
+            record = json.loads(value)
+        except ValueError:
+            logger.warning("Ignoring unreadable %s value", REMINDED_USERS_KEY)
+            return set()
         
+        if record.get('date') != reminder_date.isoformat():
+            return set()
+        return set(record.get('user_ids', []))
+    
+    def _schedule_user_reminder(self, user_id: int):
+        """
+        Queue a reminder for a specific user at a random time in the window.
+        
+        The time is picked from what is left of today's window, so starting
+        or restarting part way through the day doesn't push reminders to
+        tomorrow. Only once today's window is over is tomorrow's used.
+        """
         now = datetime.now()
-        send_time = now.replace(
-            hour=random_hour, 
-            minute=random_minute, 
-            second=0, 
-            microsecond=0
-        )
+        window_start = now.replace(hour=self.config.reminder_start_hour, minute=0, second=0, microsecond=0)
+        window_end = now.replace(hour=self.config.reminder_end_hour, minute=59, second=0, microsecond=0)
         
-        # If the time has already passed today, schedule for tomorrow
-        if now >= send_time:
-            send_time += timedelta(days=1)
+        if now >= window_end:
+            window_start += timedelta(days=1)
+            window_end += timedelta(days=1)
+        earliest = max(now.replace(second=0, microsecond=0), window_start)
+        
+        # Calculate random send time for this user, to the minute
+        window_minutes = int((window_end - earliest).total_seconds() // 60)
+        send_time = earliest + timedelta(minutes=random.randint(0, window_minutes))
         
         # Store the reminder time for this user
         self._user_reminder_times[user_id] = send_time
+        heapq.heappush(self._reminder_heap, (send_time, user_id))
         
-        logger.info(f"Reminder scheduled for user {user_id} at {send_time}")
-        
-        # Start a thread to handle this user's reminder
-        reminder_thread = threading.Thread(
-            target=self._handle_user_reminder,
-            args=(user_id, send_time, notes),
-            daemon=True
-        )
-        reminder_thread.start()
+        logger.info("Reminder scheduled for user %s at %s", user_id, send_time)
     
-    def _handle_user_reminder(self, user_id: str, send_time: datetime, notes: List[dict]):
-        """Handle reminder for a specific user."""
-        # Wait until send time
-        wait_seconds = (send_time - datetime.now()).total_seconds()
+    def _run_due_reminders(self, reminder_date: date, reminded: Set[int]) -> bool:
+        """
+        Send queued reminders in time order until none are left.
+        
+        The scheduler thread sleeps until the earliest reminder is due, so
+        waiting costs one thread regardless of how many users are queued.
+        All reminders due by then are sent in parallel on the send pool, so
+        a burst takes about one Telegram round trip rather than one per user.
+        After each batch its users are added to reminded and the set is
+        saved under REMINDED_USERS_KEY.
+        
+        Args:
+            reminder_date: Reminder day the queued reminders belong to
+            reminded: Users already handled that day; updated in place
+            
+        Returns:
+            bool: True if every queued reminder was sent, False if the
+                scheduler was stopped first
+        """
+        while self._reminder_heap and self._running:
+            send_time, _ = self._reminder_heap[0]
+            wait_seconds = (send_time - datetime.now()).total_seconds()
+            
+            if wait_seconds > 0:
+                if not self._sleep_with_check(wait_seconds):
+                    return False  # Scheduler was stopped
+            
+            now = datetime.now()
+            due_user_ids = []
+            while self._reminder_heap and self._reminder_heap[0][0] <= now:
+                _, user_id = heapq.heappop(self._reminder_heap)
+                self._user_reminder_times.pop(user_id, None)
+                due_user_ids.append(user_id)
+            
+            # One query picks a note for the whole batch; notes are read when
+            # the reminders are due, so notes added or deleted since
+            # scheduling are taken into account
+            note_by_user = self.storage.get_random_notes_by_users(due_user_ids)
+            
+            # Wait for the batch before looking at the heap again
+            list(self._send_pool.map(
+                self._handle_user_reminder,
+                due_user_ids,
+                [note_by_user.get(user_id) for user_id in due_user_ids]
+            ))
+            
+            reminded.update(due_user_ids)
+            self.storage.set_meta(REMINDED_USERS_KEY, json.dumps({
+                'date': reminder_date.isoformat(),
+                'user_ids': sorted(reminded)
+            }))
         
-        if wait_seconds > 0:
-            if not self._sleep_with_check(wait_seconds):
-                return  # Scheduler was stopped
+        return not self._reminder_heap
+    
+    def _handle_user_reminder(self, user_id: int, note: Optional[dict]):
+        """Send a due reminder to a specific user."""
+        if not note:
+            logger.debug("No notes found for user %s, skipping reminder", user_id)
+            return
         
         # Send the reminder
         try:
-            self._send_reminder(user_id, notes)
+            self._send_reminder(user_id, note)
         except Exception as e:
-            logger.error(f"Failed to send reminder to user {user_id}: {e}")
+            logger.error("Failed to send reminder to user %s: %s", user_id, e)
     
-    def _send_reminder(self, user_id: str, notes: List[dict]):
+    def _send_reminder(self, user_id: int, selected_note: dict):
         """
-        Send a random reminder message to a user.
+        Send a reminder message to a user.
+        
+        Across the scheduler thread and /test, at most
+        REMINDER_SEND_CONCURRENCY sends run at once and at most
+        REMINDER_SEND_RATE start per second, keeping bursts under
+        Telegram's global rate limit.
         
         Args:
             user_id: Telegram user ID
-            notes: List of user's notes with metadata
+            selected_note: Randomly picked note with metadata
         """
-        try:
-            selected_note = random.choice(notes)
-            note_type = selected_note.get('note_type', 'text')
-            content = selected_note.get('content', '')
-            metadata = selected_note.get('metadata', {})
-            
-            message = f"📚 Reminder:\n{content}"
-            
-            if note_type == 'text':
-                # Send text message
-                self.bot.send_message(chat_id=user_id, text=message)
+        with self._send_slots:
+            self._send_rate.wait()
+            try:
+                note_type = selected_note.get('note_type', 'text')
+                content = selected_note.get('content', '')
+                metadata = selected_note.get('metadata', {})
                 
-            elif note_type == 'image':
-                # Send image with caption
-                file_path = metadata.get('file_path', '')
-                if file_path and os.path.exists(file_path):
-                    try:
-                        with open(file_path, 'rb') as photo:
-                            self.bot.send_photo(chat_id=user_id, photo=photo, caption=message)
-                    except Exception as e:
-                        logger.error(f"Failed to send image file: {e}")
-                        # Fall back to text message
-                        self.bot.send_message(chat_id=user_id, text=message)
-                else:
-                    # Fall back to text message if file not found
-                    self.bot.send_message(chat_id=user_id, text=message)
-                    
-            elif note_type == 'voice':
-                # Send voice message with caption
-                file_path = metadata.get('file_path', '')
-                if file_path and os.path.exists(file_path):
-                    try:
-                        with open(file_path, 'rb') as voice:
-                            self.bot.send_voice(chat_id=user_id, voice=voice, caption=message)
-                    except Exception as e:
-                        logger.error(f"Failed to send voice file: {e}")
-                        # Fall back to text message
-                        self.bot.send_message(chat_id=user_id, text=message)
-                else:
-                    # Fall back to text message if file not found
-                    self.bot.send_message(chat_id=user_id, text=message)
-                    
-            elif note_type == 'document':
-                # Send document with caption
-                file_path = metadata.get('file_path', '')
-                if file_path and os.path.exists(file_path):
-                    try:
-                        with open(file_path, 'rb') as document:
-                            self.bot.send_document(chat_id=user_id, document=document, caption=message)
-                    except Exception as e:
-                        logger.error(f"Failed to send document file: {e}")
-                        # Fall back to text message
-                        self.bot.send_message(chat_id=user_id, text=message)
-                else:
-                    # Fall back to text message if file not found
+                message = f"📚 Reminder:\n{content}"
+                
+                sender = self._MEDIA_SENDERS.get(note_type)
+                file_path = metadata.get('file_path')
+                if sender is None or not file_path:
+                    # Text notes and unknown types are sent as text
                     self.bot.send_message(chat_id=user_id, text=message)
-                    
-            elif note_type == 'video':
-                # Send video with caption
-                file_path = metadata.get('file_path', '')
-                if file_path and os.path.exists(file_path):
-                    try:
-                        with open(file_path, 'rb') as video:
-                            self.bot.send_video(chat_id=user_id, video=video, caption=message)
-                    except Exception as e:
-                        logger.error(f"Failed to send video file: {e}")
-                        # Fall back to text message
-                        self.bot.send_message(chat_id=user_id, text=message)
                 else:
-                    # Fall back to text message if file not found
-                    self.bot.send_message(chat_id=user_id, text=message)
-                    
-            elif note_type == 'audio':
-                # Send audio with caption
-                file_path = metadata.get('file_path', '')
-                if file_path and os.path.exists(file_path):
+                    # Send the stored file with the reminder as caption. A
+                    # missing file fails the open, no separate exists() check.
+                    method, media_arg = sender
                     try:
-                        with open(file_path, 'rb') as audio:
-                            self.bot.send_audio(chat_id=user_id, audio=audio, caption=message)
+                        with open(file_path, 'rb') as media_file:
+                            getattr(self.bot, method)(chat_id=user_id, caption=message, **{media_arg: media_file})
                     except Exception as e:
-                        logger.error(f"Failed to send audio file: {e}")
+                        logger.error("Failed to send %s file: %s", note_type, e)
                         # Fall back to text message
                         self.bot.send_message(chat_id=user_id, text=message)
-                else:
-                    # Fall back to text message if file not found
-                    self.bot.send_message(chat_id=user_id, text=message)
-            else:
-                # Default to text message for unknown types
-                self.bot.send_message(chat_id=user_id, text=message)
-            
-            logger.info(f"Reminder sent to user {user_id}: {note_type} - {content[:50]}...")
-            
-        except Exception as e:
-            logger.error(f"Failed to send reminder to user {user_id}: {e}")
+                
+                logger.info("Reminder sent to user %s: %s - %s...", user_id, note_type, content[:50])
+                
+            except Exception as e:
+                logger.error("Failed to send reminder to user %s: %s", user_id, e)
     
     def _sleep_with_check(self, seconds: float) -> bool:
         """
-        Sleep for specified seconds while checking if scheduler should stop.
+        Sleep for specified seconds, waking immediately if the scheduler stops.
         
         Args:
             seconds: Number of seconds to sleep
@@ -268,17 +375,9 @@ class MultiUserScheduler:
         Returns:
             bool: True if completed normally, False if interrupted
         """
-        end_time = time.time() + seconds
-        
-        while time.time() < end_time and self._running:
-            # Sleep in small chunks to allow for responsive shutdown
-            remaining = min(1.0, end_time - time.time())
-            if remaining > 0:
-                time.sleep(remaining)
-        
-        return self._running
+        return not self._stop_event.wait(timeout=seconds)
     
-    def send_test_reminder(self, user_id: str) -> bool:
+    def send_test_reminder(self, user_id: int) -> bool:
         """
         Send a test reminder to a specific user immediately.
         
@@ -288,18 +387,18 @@ class MultiUserScheduler:
         Returns:
             bool: True if successful, False otherwise
         """
-        notes = self.storage.get_notes_with_metadata(user_id)
-        if not notes:
+        note = self.storage.get_random_note(user_id)
+        if not note:
             return False
         
         try:
-            self._send_reminder(user_id, notes)
+            self._send_reminder(user_id, note)
             return True
         except Exception as e:
-            logger.error(f"Failed to send test reminder to user {user_id}: {e}")
+            logger.error("Failed to send test reminder to user %s: %s", user_id, e)
             return False
     
-    def get_next_reminder_time(self, user_id: str) -> Optional[datetime]:
+    def get_next_reminder_time(self, user_id: int) -> Optional[datetime]:
         """
         Get the next scheduled reminder time for a user.
         
@@ -322,11 +421,14 @@ class MultiUserScheduler:
         total_notes = self.storage.get_total_notes()
         active_users = len(self.storage.get_all_user_ids())
         scheduled_reminders = len(self._user_reminder_times)
+        db_pool = self.storage.get_pool_status()
+        logger.info("Database pool: %s", db_pool)
         
         return {
             'total_users': total_users,
             'total_notes': total_notes,
             'active_users': active_users,
             'scheduled_reminders': scheduled_reminders,
+            'db_pool': db_pool,
             'running': self._running
                                          }
@@ -1,19 +1,27 @@
 """
 Scheduler module for handling automatic reminder functionality.
-Manages the background thread that sends random note reminders.
+Schedules random note reminders as jobs on an APScheduler background scheduler.
 """
 
-import threading
-import time
 import random
 import logging
 from datetime import datetime, timedelta
 from typing import Optional
+import pytz
 import telegram
+from apscheduler.schedulers.background import BackgroundScheduler
+from telegram.utils.request import Request
 from storage import FileStorage
 
 logger = logging.getLogger(__name__)
 
+# ID of the job sending the next reminder; there is only ever one
+REMINDER_JOB_ID = 'reminder'
+
+# Pooled connections kept open to the Bot API, so scheduled reminders and
+# test reminders sent from other threads reuse them instead of connecting
+BOT_CON_POOL_SIZE = 8
+
 class ReminderScheduler:
     """Handles scheduled reminder functionality."""
     
@@ -29,135 +37,139 @@ class ReminderScheduler:
         self.bot_token = bot_token
         self.storage = storage
         self.config = config
-        self.bot = telegram.Bot(token=bot_token)
-        self._running = False
-        self._thread: Optional[threading.Thread] = None
+        self.bot = telegram.Bot(token=bot_token, request=Request(con_pool_size=BOT_CON_POOL_SIZE))
+        self._scheduler: Optional[BackgroundScheduler] = None
     
     def start(self):
-        """Start the reminder scheduler in a background thread."""
-        if self._running:
+        """Start the reminder scheduler and schedule the first reminder."""
+        if self._scheduler is not None:
             logger.warning("Scheduler is already running")
             return
         
-        self._running = True
-        self._thread = threading.Thread(target=self._run_scheduler, daemon=True)
-        self._thread.start()
+        # APScheduler 3.6 only accepts pytz timezones, and the local zone
+        # may not be one, so jobs are scheduled in UTC
+        self._scheduler = BackgroundScheduler(timezone=pytz.utc, daemon=True)
+        self._scheduler.start()
+        self._schedule_next(datetime.now())
         logger.info("Reminder scheduler started")
     
     def stop(self):
         """Stop the reminder scheduler."""
-        self._running = False
-        if self._thread and self._thread.is_alive():
-            self._thread.join(timeout=5)
+        if self._scheduler is not None:
+            self._scheduler.shutdown(wait=False)
+            self._scheduler = None
         logger.info("Reminder scheduler stopped")
     
-    def _run_scheduler(self):
-        """Main scheduler loop that runs in the background thread."""
-        logger.info("Scheduler thread started")
-        
-        while self._running:
-            try:
-                today = datetime.now().date()
-                
-                # Check if today is a reminder day (every other day)
-                if today.day % self.config.reminder_interval_days == 0:
-                    self._handle_reminder_day()
-                else:
-                    logger.debug(f"Not a reminder day (day {today.day})")
-                    # Sleep for 1 hour and check again
-                    self._sleep_with_check(3600)
-            
-            except Exception as e:
-                logger.error(f"Error in scheduler loop: {e}")
-                # Sleep for 5 minutes before retrying
-                self._sleep_with_check(300)
-    
-    def _handle_reminder_day(self):
-        """Handle reminder logic for today."""
-        chat_id = self.storage.get_chat_id()
-        notes = self.storage.get_notes()
+    def _schedule_next(self, now: datetime):
+        """
+        Schedule the next reminder after now as a one-off job.
         
-        if not chat_id:
-            logger.warning("No chat ID found, skipping reminder")
-            self._sleep_with_check(3600)
+        Args:
+            now: Time to schedule after
+        """
+        scheduler = self._scheduler
+        if scheduler is None:
             return
         
-        if not notes:
-            logger.warning("No notes found, skipping reminder")
-            self._sleep_with_check(3600)
+        try:
+            send_time = self._next_reminder_datetime(now)
+        except ValueError as e:
+            logger.error("Cannot schedule reminders: %s", e)
             return
         
-        # Calculate random send time
-        random_hour = random.randint(
-            self.config.reminder_start_hour, 
-            self.config.reminder_end_hour
+        # Run late rather than never if the process was suspended at send
+        # time; each run schedules the one after it
+        scheduler.add_job(
+            self._run_reminder,
+            trigger='date',
+            run_date=send_time.astimezone(pytz.utc),
+            args=[send_time],
+            id=REMINDER_JOB_ID,
+            replace_existing=True,
+            misfire_grace_time=None
         )
-        random_minute = random.randint(0, 59)
+        wait_seconds = (send_time - datetime.now()).total_seconds()
+        logger.info("Next reminder scheduled for %s (in %.0f seconds)", send_time, wait_seconds)
+    
+    def _run_reminder(self, send_time: datetime):
+        """
+        Send a scheduled reminder, then schedule the next one.
         
-        now = datetime.now()
+        Args:
+            send_time: Time the reminder was scheduled for
+        """
+        try:
+            self._handle_reminder_day()
+        except Exception as e:
+            logger.error("Error sending scheduled reminder: %s", e)
+        
+        # At most one reminder a day: look from the next day on
+        next_day = datetime.combine(send_time.date() + timedelta(days=1), datetime.min.time())
+        self._schedule_next(max(datetime.now(), next_day))
+    
+    def _next_reminder_datetime(self, now: datetime) -> datetime:
+        """
+        Pick the time of the next reminder after now.
+        
+        Reminders go out on days of the month divisible by
+        reminder_interval_days, at a random time within the reminder hours.
+        
+        Args:
+            now: Time to schedule after
+            
+        Returns:
+            datetime: When to send the next reminder
+            
+        Raises:
+            ValueError: If no day of the month is a reminder day
+        """
         send_time = now.replace(
-            hour=random_hour, 
-            minute=random_minute, 
-            second=0, 
+            hour=random.randint(self.config.reminder_start_hour, self.config.reminder_end_hour),
+            minute=random.randint(0, 59),
+            second=0,
             microsecond=0
         )
         
-        # If the time has already passed today, schedule for tomorrow
-        if now >= send_time:
+        # Every day of the month comes up within two months
+        for _ in range(62):
+            if send_time.day % self.config.reminder_interval_days == 0 and send_time > now:
+                return send_time
             send_time += timedelta(days=1)
         
-        # Wait until send time
-        wait_seconds = (send_time - datetime.now()).total_seconds()
-        logger.info(f"Next reminder scheduled for {send_time} (in {wait_seconds:.0f} seconds)")
+        raise ValueError(
+            f"No day of the month is divisible by {self.config.reminder_interval_days}"
+        )
+    
+    def _handle_reminder_day(self):
+        """Send today's reminder, if there is a chat and notes to send."""
+        chat_id = self.storage.get_chat_id()
+        if not chat_id:
+            logger.warning("No chat ID found, skipping reminder")
+            return
         
-        if self._sleep_with_check(wait_seconds):
-            # Send the reminder
-            self._send_reminder(chat_id, notes)
-            
-            # Sleep until next day
-            next_check = datetime.now().replace(
-                hour=0, minute=0, second=0, microsecond=0
-            ) + timedelta(days=1)
-            sleep_until_next_day = (next_check - datetime.now()).total_seconds()
-            self._sleep_with_check(sleep_until_next_day)
+        selected_note = self.storage.get_random_note()
+        if selected_note is None:
+            logger.warning("No notes found, skipping reminder")
+            return
+        
+        self._send_reminder(chat_id, selected_note)
     
-    def _send_reminder(self, chat_id: str, notes: list):
+    def _send_reminder(self, chat_id: str, selected_note: str):
         """
-        Send a random reminder message.
+        Send a note as a reminder message.
         
         Args:
             chat_id: Telegram chat ID
-            notes: List of available notes
+            selected_note: Note to send
         """
         try:
-            selected_note = random.choice(notes)
             message = f"📚 Reminder:\n{selected_note}"
             
             self.bot.send_message(chat_id=chat_id, text=message)
-            logger.info(f"Reminder sent: {selected_note[:50]}...")
+            logger.info("Reminder sent: %s...", selected_note[:50])
             
         except Exception as e:
-            logger.error(f"Failed to send reminder: {e}")
-    
-    def _sleep_with_check(self, seconds: float) -> bool:
-        """
-        Sleep for specified seconds while checking if scheduler should stop.
-        
-        Args:
-            seconds: Number of seconds to sleep
-            
-        Returns:
-            bool: True if completed normally, False if interrupted
-        """
-        end_time = time.time() + seconds
-        
-        while time.time() < end_time and self._running:
-            # Sleep in small chunks to allow for responsive shutdown
-            remaining = min(1.0, end_time - time.time())
-            if remaining > 0:
-                time.sleep(remaining)
-        
-        return self._running
+            logger.error("Failed to send reminder: %s", e)
     
     def send_test_reminder(self, chat_id: str) -> bool:
         """
@@ -169,13 +181,13 @@ class ReminderScheduler:
         Returns:
             bool: True if successful, False otherwise
         """
-        notes = self.storage.get_notes()
-        if not notes:
+        selected_note = self.storage.get_random_note()
+        if selected_note is None:
             return False
         
         try:
-            self._send_reminder(chat_id, notes)
+            self._send_reminder(chat_id, selected_note)
             return True
         except Exception as e:
-            logger.error(f"Failed to send test reminder: {e}")
+            logger.error("Failed to send test reminder: %s", e)
             return False
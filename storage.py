@@ -3,13 +3,120 @@ Storage module for handling file operations for notes and chat IDs.
 Provides thread-safe file operations with proper error handling.
 """
 
+import atexit
+import io
 import os
+import random
+import re
 import threading
+import weakref
 import logging
-from typing import List, Optional
+from contextlib import contextmanager
+from typing import List, Optional, TextIO, Tuple
 
 logger = logging.getLogger(__name__)
 
+# Saved notes are buffered and appended to the notes file in one write,
+# at most this many seconds after the first one in the buffer...
+NOTES_FLUSH_INTERVAL = 0.5
+# ...or as soon as this many are waiting
+NOTES_FLUSH_MAX_PENDING = 100
+
+# Deleted notes are recorded in a tombstones file next to the notes file;
+# once more than this many pile up, the notes file is rewritten without them
+NOTES_COMPACT_THRESHOLD = 100
+
+# A line of the notes file, with its ending, as text mode would split it
+_LINE_PATTERN = re.compile(r"[^\r\n]*(?:\r\n|\r|\n)|[^\r\n]+$")
+
+def _write_atomic(path: str, text: str):
+    """
+    Replace a file's contents with text, all or nothing.
+    
+    The text goes to a temporary file next to it, which then replaces the
+    file, so a crash part way leaves the old contents in place.
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def _ends_mid_line(path: str) -> bool:
+    """Return whether a file is non-empty and its last line has no line ending."""
+    with open(path, "rb") as f:
+        if f.seek(0, os.SEEK_END) == 0:
+            return False
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) not in (b"\n", b"\r")
+
+def _parse_notes(text: str) -> List[str]:
+    """
+    Turn notes file contents into notes, skipping blank lines.
+    
+    Line endings must already be translated to newlines, as reading the
+    file in text mode does. Splitting on newlines only, rather than with
+    splitlines(), keeps separators such as form feeds inside a note.
+    """
+    return [note for note in map(str.strip, text.split("\n")) if note]
+
+class RWLock:
+    """
+    Reader-writer lock: any number of readers, or a single writer.
+    
+    A waiting writer stops new readers from entering, so a steady stream of
+    reads cannot starve writes. Not reentrant.
+    """
+    
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writing = False
+        self._writers_waiting = 0
+    
+    @contextmanager
+    def read_lock(self):
+        """Hold the lock shared with other readers."""
+        with self._cond:
+            while self._writing or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+    
+    @contextmanager
+    def write_lock(self):
+        """Hold the lock exclusively."""
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writing or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+# Live FileStorage instances, closed at exit so buffered notes are written.
+# Held weakly so registering does not keep instances alive; an instance
+# with notes still buffered stays alive through its flush timer anyway.
+_open_storages: "weakref.WeakSet[FileStorage]" = weakref.WeakSet()
+
+@atexit.register
+def _close_open_storages():
+    """Write buffered notes and close the notes file of every live instance."""
+    for file_storage in list(_open_storages):
+        file_storage.close()
+
 class FileStorage:
     """Thread-safe file storage for notes and chat IDs."""
     
@@ -17,12 +124,158 @@ class FileStorage:
         """Initialize file storage with file paths."""
         self.notes_file = notes_file
         self.chat_id_file = chat_id_file
-        self._lock = threading.Lock()
+        # Positions (in the parsed notes file) of deleted notes, one per line
+        self.tombstones_file = notes_file + ".tombstones"
+        # One lock per file, so notes and chat ID operations never wait on
+        # each other. Notes are read without locking (see _notes_snapshot),
+        # so their lock only serializes writers. Chat ID reads share a lock;
+        # writes take it exclusively.
+        self._notes_lock = threading.Lock()
+        self._chat_id_lock = RWLock()
+        # Contents of chat_id_file once read, kept equal to what reading it
+        # would return. Readers may fill it in; they all compute the same
+        # value, so concurrent fills are harmless.
+        self._chat_id_cache: Optional[str] = None
+        self._chat_id_loaded = False
+        # Live notes parsed from notes_file, loaded on first use and kept
+        # equal to what loading the files would return. Writers never modify
+        # it: they build a new tuple and assign it, which readers see
+        # atomically, so readers need no lock. Loaded and replaced under
+        # _notes_lock, as are the fields below.
+        self._notes_snapshot: Optional[Tuple[str, ...]] = None
+        # Position in the parsed file of each live note, the tombstoned
+        # positions, and how many notes the file holds counting deleted ones
+        self._note_positions: List[int] = []
+        self._tombstones: set = set()
+        self._stored_count = 0
+        # Entries saved but not yet appended to notes_file; the snapshot
+        # already includes them. Guarded by _notes_lock.
+        self._write_buffer: List[str] = []
+        self._flush_timer: Optional[threading.Timer] = None
+        # Append handle on notes_file, opened on the first flush and kept
+        # open between them. Guarded by _notes_lock.
+        self._notes_fh: Optional[TextIO] = None
+        _open_storages.add(self)
+    
+    def _notes(self) -> Tuple[str, ...]:
+        """Return the current notes snapshot, loading it on first use."""
+        snapshot = self._notes_snapshot
+        if snapshot is None:
+            with self._notes_lock:
+                snapshot = self._load_notes()
+        return snapshot
+    
+    def _load_notes(self) -> Tuple[str, ...]:
+        """Return the notes snapshot, reading the files if needed. Call with _notes_lock held."""
+        if self._notes_snapshot is None:
+            notes = []
+            if os.path.exists(self.notes_file):
+                with open(self.notes_file, "r", encoding="utf-8") as f:
+                    notes = _parse_notes(f.read())
+            pending = "".join(self._write_buffer)
+            notes += _parse_notes(io.StringIO(pending, newline=None).read())
+            
+            tombstones = set()
+            if os.path.exists(self.tombstones_file):
+                with open(self.tombstones_file, "r", encoding="utf-8") as f:
+                    tombstones = {int(line) for line in f if line.strip()}
+            
+            positions = [i for i in range(len(notes)) if i not in tombstones]
+            self._note_positions = positions
+            self._tombstones = tombstones
+            self._stored_count = len(notes)
+            self._notes_snapshot = tuple(notes[i] for i in positions)
+        return self._notes_snapshot
+    
+    def _write_pending(self):
+        """Append buffered entries to the notes file. Call with _notes_lock held."""
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        if not self._write_buffer:
+            return
+        
+        if self._notes_fh is None:
+            # A file written by hand or by older code may not end in a line
+            # break; without one, the first appended note would join its
+            # last line
+            separator = "\n" if os.path.exists(self.notes_file) and _ends_mid_line(self.notes_file) else ""
+            self._notes_fh = open(self.notes_file, "a", encoding="utf-8", buffering=8192)
+            self._notes_fh.write(separator)
+        self._notes_fh.write("".join(self._write_buffer))
+        self._notes_fh.flush()
+        self._write_buffer.clear()
+    
+    def _close_notes_file(self):
+        """Close the append handle, if open. Call with _notes_lock held."""
+        if self._notes_fh is not None:
+            self._notes_fh.close()
+            self._notes_fh = None
+    
+    def _text_before(self, position: int) -> str:
+        """Return the notes file's contents before the note at a parsed position, line endings untouched."""
+        if not os.path.exists(self.notes_file):
+            return ""
+        with open(self.notes_file, "r", encoding="utf-8", newline="") as f:
+            text = f.read()
+        
+        count = 0
+        for match in _LINE_PATTERN.finditer(text):
+            if match.group().strip():
+                if count == position:
+                    return text[:match.start()]
+                count += 1
+        return text
+    
+    def _compact(self):
+        """Rewrite the notes file without deleted notes. Call with _notes_lock held."""
+        self._write_pending()
+        notes = self._load_notes()
+        # Notes before the first deleted one are where they were, so the
+        # file up to that note is copied as it is rather than re-serialized
+        first_deleted = min(self._tombstones, default=len(notes))
+        text = self._text_before(first_deleted)
+        kept = notes[first_deleted:]
+        if kept:
+            text += "\n".join(kept) + "\n"
+        
+        # Drop the tombstones first: if the rewrite fails, deleted notes
+        # come back rather than tombstones hiding the wrong ones
+        if os.path.exists(self.tombstones_file):
+            os.remove(self.tombstones_file)
+        self._close_notes_file()
+        _write_atomic(self.notes_file, text)
+        
+        self._note_positions = list(range(len(notes)))
+        self._tombstones = set()
+        self._stored_count = len(notes)
+        logger.info("Notes file compacted: %s notes kept", len(notes))
+    
+    def flush(self):
+        """Write any buffered notes to the notes file now."""
+        try:
+            with self._notes_lock:
+                self._write_pending()
+        except Exception as e:
+            logger.error("Failed to write buffered notes: %s", e)
+    
+    def close(self):
+        """Write any buffered notes and close the notes file."""
+        try:
+            with self._notes_lock:
+                self._write_pending()
+                self._close_notes_file()
+        except Exception as e:
+            logger.error("Failed to close notes file: %s", e)
     
     def save_note(self, note: str) -> bool:
         """
         Save a note to the notes file.
         
+        The note is visible to readers at once but reaches the file with
+        other recent notes in a single append; call flush() to write it
+        immediately.
+        
         Args:
             note: The note text to save
             
@@ -30,13 +283,26 @@ class FileStorage:
             bool: True if successful, False otherwise
         """
         try:
-            with self._lock:
-                with open(self.notes_file, "a", encoding="utf-8") as f:
-                    f.write(note.strip() + "\n")
-                logger.info(f"Note saved: {note[:50]}...")
+            with self._notes_lock:
+                entry = note.strip() + "\n"
+                self._write_buffer.append(entry)
+                if len(self._write_buffer) >= NOTES_FLUSH_MAX_PENDING:
+                    self._write_pending()
+                elif self._flush_timer is None:
+                    self._flush_timer = threading.Timer(NOTES_FLUSH_INTERVAL, self.flush)
+                    self._flush_timer.daemon = True
+                    self._flush_timer.start()
+                if self._notes_snapshot is not None:
+                    # Parse the entry the way reading it back would, so a note
+                    # with line breaks is cached as the lines it becomes
+                    added = _parse_notes(io.StringIO(entry, newline=None).read())
+                    self._note_positions.extend(range(self._stored_count, self._stored_count + len(added)))
+                    self._stored_count += len(added)
+                    self._notes_snapshot += tuple(added)
+                logger.info("Note saved: %s...", note[:50])
                 return True
         except Exception as e:
-            logger.error(f"Failed to save note: {e}")
+            logger.error("Failed to save note: %s", e)
             return False
     
     def get_notes(self) -> List[str]:
@@ -47,17 +313,28 @@ class FileStorage:
             List[str]: List of all notes
         """
         try:
-            with self._lock:
-                if not os.path.exists(self.notes_file):
-                    return []
-                
-                with open(self.notes_file, "r", encoding="utf-8") as f:
-                    notes = [line.strip() for line in f if line.strip()]
-                return notes
+            return list(self._notes())
         except Exception as e:
-            logger.error(f"Failed to read notes: {e}")
+            logger.error("Failed to read notes: %s", e)
             return []
     
+    def get_random_note(self) -> Optional[str]:
+        """
+        Get one randomly chosen note.
+        
+        Picks straight from the snapshot, without copying every note the
+        way get_notes does.
+        
+        Returns:
+            Optional[str]: A note, or None if there are none
+        """
+        try:
+            notes = self._notes()
+            return random.choice(notes) if notes else None
+        except Exception as e:
+            logger.error("Failed to read notes: %s", e)
+            return None
+    
     def save_chat_id(self, chat_id: str) -> bool:
         """
         Save chat ID to file.
@@ -69,13 +346,14 @@ class FileStorage:
             bool: True if successful, False otherwise
         """
         try:
-            with self._lock:
-                with open(self.chat_id_file, "w", encoding="utf-8") as f:
-                    f.write(str(chat_id))
-                logger.info(f"Chat ID saved: {chat_id}")
+            with self._chat_id_lock.write_lock():
+                _write_atomic(self.chat_id_file, str(chat_id))
+                self._chat_id_cache = str(chat_id).strip() or None
+                self._chat_id_loaded = True
+                logger.info("Chat ID saved: %s", chat_id)
                 return True
         except Exception as e:
-            logger.error(f"Failed to save chat ID: {e}")
+            logger.error("Failed to save chat ID: %s", e)
             return False
     
     def get_chat_id(self) -> Optional[str]:
@@ -86,15 +364,18 @@ class FileStorage:
             Optional[str]: Chat ID if exists, None otherwise
         """
         try:
-            with self._lock:
-                if not os.path.exists(self.chat_id_file):
-                    return None
-                
-                with open(self.chat_id_file, "r", encoding="utf-8") as f:
-                    chat_id = f.read().strip()
-                return chat_id if chat_id else None
+            with self._chat_id_lock.read_lock():
+                if not self._chat_id_loaded:
+                    chat_id = None
+                    if os.path.exists(self.chat_id_file):
+                        # Chat IDs are ASCII digits, so no text decoding is needed
+                        with open(self.chat_id_file, "rb") as f:
+                            chat_id = f.read().strip().decode("ascii") or None
+                    self._chat_id_cache = chat_id
+                    self._chat_id_loaded = True
+                return self._chat_id_cache
         except Exception as e:
-            logger.error(f"Failed to read chat ID: {e}")
+            logger.error("Failed to read chat ID: %s", e)
             return None
     
     def get_notes_count(self) -> int:
@@ -104,7 +385,11 @@ class FileStorage:
         Returns:
             int: Number of notes
         """
-        return len(self.get_notes())
+        try:
+            return len(self._notes())
+        except Exception as e:
+            logger.error("Failed to read notes: %s", e)
+            return 0
     
     def clear_notes(self) -> bool:
         """
@@ -114,13 +399,22 @@ class FileStorage:
             bool: True if successful, False otherwise
         """
         try:
-            with self._lock:
-                if os.path.exists(self.notes_file):
-                    os.remove(self.notes_file)
+            with self._notes_lock:
+                self._close_notes_file()
+                # Tombstones first, as in _compact: left behind, they would
+                # hide the first new notes saved at their positions
+                for path in (self.tombstones_file, self.notes_file):
+                    if os.path.exists(path):
+                        os.remove(path)
+                self._write_buffer.clear()
+                self._note_positions = []
+                self._tombstones = set()
+                self._stored_count = 0
+                self._notes_snapshot = ()
                 logger.info("All notes cleared")
                 return True
         except Exception as e:
-            logger.error(f"Failed to clear notes: {e}")
+            logger.error("Failed to clear notes: %s", e)
             return False
     
     def delete_note_by_index(self, index: int) -> bool:
@@ -134,30 +428,31 @@ class FileStorage:
             bool: True if successful, False otherwise
         """
         try:
-            with self._lock:
-                # Read notes fresh from file
-                if not os.path.exists(self.notes_file):
-                    logger.error("Notes file does not exist")
-                    return False
-                
-                with open(self.notes_file, "r", encoding="utf-8") as f:
-                    notes = [line.strip() for line in f if line.strip()]
+            with self._notes_lock:
+                notes = self._load_notes()
                 
                 if not notes or index < 0 or index >= len(notes):
-                    logger.error(f"Invalid note index: {index}, total notes: {len(notes)}")
+                    logger.error("Invalid note index: %s, total notes: %s", index, len(notes))
                     return False
                 
-                # Remove the note at the specified index
-                deleted_note = notes.pop(index)
+                # Tombstones name positions in the file, so the note must be
+                # written out before its deletion is recorded. The snapshot
+                # only changes once the tombstone is on disk.
+                self._write_pending()
+                position = self._note_positions[index]
+                with open(self.tombstones_file, "a", encoding="utf-8") as f:
+                    f.write(f"{position}\n")
+                self._tombstones.add(position)
+                del self._note_positions[index]
+                self._notes_snapshot = notes[:index] + notes[index + 1:]
+                deleted_note = notes[index]
                 
-                # Write the remaining notes back to file
-                with open(self.notes_file, "w", encoding="utf-8") as f:
-                    for note in notes:
-                        f.write(note + "\n")
+                if len(self._tombstones) > NOTES_COMPACT_THRESHOLD:
+                    self._compact()
                 
-                logger.info(f"Note deleted successfully at index {index}: {deleted_note[:50]}...")
+                logger.info("Note deleted successfully at index %s: %s...", index, deleted_note[:50])
                 return True
                 
         except Exception as e:
-            logger.error(f"Failed to delete note at index {index}: {e}")
+            logger.error("Failed to delete note at index %s: %s", index, e)
             return False
@@ -0,0 +1,134 @@
+"""
+Tests for the legacy file-based note storage.
+Checks that what FileStorage holds in memory always matches what a fresh
+instance reads back from disk, across saves, deletes, compaction and clears.
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+# Add the current directory to the Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import storage
+from storage import FileStorage
+
+def _open(storage_dir: str) -> FileStorage:
+    """Create a FileStorage in the given directory."""
+    return FileStorage(os.path.join(storage_dir, "notes.txt"), os.path.join(storage_dir, "chat_id.txt"))
+
+def _reload(storage_dir: str) -> list:
+    """Read the notes back with a fresh FileStorage."""
+    return _open(storage_dir).get_notes()
+
+def test_save_and_reload():
+    """Saved notes, including multi-line and blank ones, read back the same."""
+    with tempfile.TemporaryDirectory() as storage_dir:
+        notes = _open(storage_dir)
+        for note in ["first", "  padded  ", "", "two\nlines", "cr\rsplit", "crlf\r\nsplit"]:
+            assert notes.save_note(note)
+        
+        expected = ["first", "padded", "two", "lines", "cr", "split", "crlf", "split"]
+        assert notes.get_notes() == expected
+        assert notes.get_notes_count() == len(expected)
+        
+        notes.flush()
+        assert _reload(storage_dir) == expected
+        notes.close()
+
+def test_buffered_notes_flush_on_timer():
+    """Buffered notes reach the file without an explicit flush."""
+    with tempfile.TemporaryDirectory() as storage_dir:
+        notes = _open(storage_dir)
+        notes.save_note("buffered")
+        time.sleep(storage.NOTES_FLUSH_INTERVAL + 0.5)
+        assert _reload(storage_dir) == ["buffered"]
+        notes.close()
+
+def test_delete_and_reload():
+    """Deleted notes stay deleted after a reload, including unflushed ones."""
+    with tempfile.TemporaryDirectory() as storage_dir:
+        notes = _open(storage_dir)
+        for note in ["a", "b", "c", "d"]:
+            notes.save_note(note)
+        
+        assert notes.delete_note_by_index(1)
+        assert notes.delete_note_by_index(2)
+        assert not notes.delete_note_by_index(5)
+        assert notes.get_notes() == ["a", "c"]
+        assert _reload(storage_dir) == ["a", "c"]
+        
+        notes.save_note("e")
+        notes.flush()
+        assert _reload(storage_dir) == ["a", "c", "e"]
+        notes.close()
+
+def test_compaction(monkeypatch):
+    """Compaction drops deleted notes from the file and keeps the rest as is."""
+    monkeypatch.setattr(storage, "NOTES_COMPACT_THRESHOLD", 2)
+    with tempfile.TemporaryDirectory() as storage_dir:
+        notes_file = os.path.join(storage_dir, "notes.txt")
+        with open(notes_file, "w", encoding="utf-8", newline="") as f:
+            f.write("  kept \r\n\nsecond\nthird\nfourth\nfifth\n")
+        
+        notes = _open(storage_dir)
+        for index in (3, 2, 1):
+            assert notes.delete_note_by_index(index)
+        
+        assert notes.get_notes() == ["kept", "fifth"]
+        assert not os.path.exists(notes_file + ".tombstones")
+        with open(notes_file, "r", encoding="utf-8", newline="") as f:
+            assert f.read() == "  kept \r\n\nfifth\n"
+        assert _reload(storage_dir) == ["kept", "fifth"]
+        
+        # Positions restart from the compacted file
+        notes.save_note("sixth")
+        assert notes.delete_note_by_index(0)
+        assert _reload(storage_dir) == ["fifth", "sixth"]
+        notes.close()
+
+def test_clear_and_reload():
+    """Notes saved after a clear are not hidden by earlier deletions."""
+    with tempfile.TemporaryDirectory() as storage_dir:
+        notes = _open(storage_dir)
+        for note in ["a", "b", "c"]:
+            notes.save_note(note)
+        notes.delete_note_by_index(0)
+        
+        assert notes.clear_notes()
+        assert notes.get_notes() == []
+        assert _reload(storage_dir) == []
+        
+        notes.save_note("new")
+        notes.flush()
+        assert _reload(storage_dir) == ["new"]
+        notes.close()
+
+def test_legacy_file_without_trailing_newline():
+    """Appending to a file whose last line has no line break starts a new line."""
+    with tempfile.TemporaryDirectory() as storage_dir:
+        notes_file = os.path.join(storage_dir, "notes.txt")
+        with open(notes_file, "w", encoding="utf-8") as f:
+            f.write("one\ntwo")
+        
+        notes = _open(storage_dir)
+        assert notes.get_notes() == ["one", "two"]
+        notes.save_note("three")
+        notes.flush()
+        assert _reload(storage_dir) == ["one", "two", "three"]
+        
+        assert notes.delete_note_by_index(2)
+        assert _reload(storage_dir) == ["one", "two"]
+        notes.close()
+
+def test_chat_id_round_trip():
+    """The chat ID reads back as saved, without surrounding whitespace."""
+    with tempfile.TemporaryDirectory() as storage_dir:
+        notes = _open(storage_dir)
+        assert notes.get_chat_id() is None
+        assert notes.save_chat_id(" -100123 ")
+        assert notes.get_chat_id() == "-100123"
+        assert _open(storage_dir).get_chat_id() == "-100123"
+        notes.close()
@@ -2,12 +2,13 @@
 """
 Test script to verify multimedia support in the Telegram Notes Reminder Bot.
 This script tests the database operations for different note types.
+Runs under pytest or directly; uses DATABASE_URL when the environment is
+configured and a temporary SQLite database otherwise.
 """
 
-import json
 import sys
 import os
-from datetime import datetime
+import tempfile
 
 # Add the current directory to the Python path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
@@ -15,32 +16,31 @@ sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 from db_storage import DatabaseStorage
 from config import Config
 
-def test_multimedia_storage():
+def _database_url(tmp_path) -> str:
+    """Use the configured database, or a SQLite file in tmp_path without one."""
+    try:
+        return Config.from_env().database_url
+    except ValueError as e:
+        print(f"ℹ️ No usable configuration ({e}), using a temporary SQLite database")
+        return f"sqlite:///{os.path.join(tmp_path, 'test_notes.db')}"
+
+def test_multimedia_storage(tmp_path):
     """Test storing and retrieving multimedia notes."""
     print("🧪 Testing multimedia note storage...")
     
-    # Initialize components
-    config = Config()
-    if not config.validate():
-        print("❌ Configuration validation failed")
-        return False
-    
-    storage = DatabaseStorage(config.database_url)
-    test_user_id = "test_user_123"
+    storage = DatabaseStorage(_database_url(tmp_path))
+    test_user_id = 123
     
     # Test user creation
     print("👤 Testing user creation...")
-    success = storage.save_user(
+    assert storage.save_user(
         user_id=test_user_id,
         username="testuser",
         first_name="Test",
         last_name="User"
-    )
-    if success:
-        print("✅ User created successfully")
-    else:
-        print("❌ User creation failed")
-        return False
+    ), "User creation failed"
+    # Start from no notes, in case an earlier run against the same database failed
+    assert storage.clear_notes(test_user_id), "Failed to clear leftover notes"
     
     # Test different note types
     test_cases = [
@@ -116,80 +116,58 @@ def test_multimedia_storage():
     
     print(f"📝 Testing {len(test_cases)} different note types...")
     
-    for i, case in enumerate(test_cases):
-        print(f"  {i+1}. Testing {case['type']} note...")
-        success = storage.save_note(
-            user_id=test_user_id,
-            content=case['content'],
-            note_type=case['type'],
-            note_metadata=case['metadata']
-        )
-        if success:
-            print(f"    ✅ {case['type']} note saved successfully")
-        else:
-            print(f"    ❌ {case['type']} note save failed")
-            return False
+    # Save all notes in one transaction
+    records = [
+        {
+            "content": case['content'],
+            "note_type": case['type'],
+            "note_metadata": case['metadata']
+        }
+        for case in test_cases
+    ]
+    assert storage.save_notes_bulk(test_user_id, records), "Bulk note save failed"
+    saved_types = ", ".join(case['type'] for case in test_cases)
+    print(f"✅ {len(records)} notes saved successfully ({saved_types})")
     
     # Test retrieval
     print("📚 Testing note retrieval...")
     notes = storage.get_notes_with_metadata(test_user_id)
+    assert len(notes) == len(test_cases), f"Expected {len(test_cases)} notes, got {len(notes)}"
     
-    if len(notes) == len(test_cases):
-        print(f"✅ Retrieved {len(notes)} notes successfully")
-        
-        # Check each note type
-        for note in notes:
-            note_type = note.get('note_type', 'unknown')
-            content = note.get('content', '')
-            metadata = note.get('metadata', {})
-            
-            print(f"  📋 {note_type}: {content[:50]}...")
-            
-            if note_type != 'text' and metadata:
-                file_path = metadata.get('file_path', '')
-                print(f"    📂 File: {file_path}")
-    else:
-        print(f"❌ Expected {len(test_cases)} notes, got {len(notes)}")
-        return False
+    # Every note reads back with its type, content and metadata
+    saved = sorted((case['type'], case['content'], case['metadata']) for case in test_cases)
+    read = sorted((note['note_type'], note['content'], note['metadata']) for note in notes)
+    assert read == saved, "Notes read back differently from how they were saved"
+    print(f"✅ Retrieved {len(notes)} notes successfully")
     
     # Test statistics
     print("📊 Testing statistics...")
     count = storage.get_notes_count(test_user_id)
-    if count == len(test_cases):
-        print(f"✅ Note count correct: {count}")
-    else:
-        print(f"❌ Expected count {len(test_cases)}, got {count}")
-        return False
+    assert count == len(test_cases), f"Expected count {len(test_cases)}, got {count}"
+    print(f"✅ Note count correct: {count}")
     
     # Test cleanup
     print("🧹 Testing cleanup...")
-    if storage.clear_notes(test_user_id):
-        print("✅ Notes cleared successfully")
-        
-        # Verify cleanup
-        remaining_notes = storage.get_notes_count(test_user_id)
-        if remaining_notes == 0:
-            print("✅ All notes removed")
-        else:
-            print(f"❌ Expected 0 notes after cleanup, got {remaining_notes}")
-            return False
-    else:
-        print("❌ Failed to clear notes")
-        return False
+    assert storage.clear_notes(test_user_id), "Failed to clear notes"
+    remaining_notes = storage.get_notes_count(test_user_id)
+    assert remaining_notes == 0, f"Expected 0 notes after cleanup, got {remaining_notes}"
+    print("✅ All notes removed")
     
     print("\n🎉 All multimedia storage tests passed!")
-    return True
 
 def main():
     """Run all tests."""
     print("🚀 Starting multimedia support tests...\n")
     
-    if test_multimedia_storage():
-        print("\n✅ All tests passed successfully!")
-        return 0
-    else:
-        print("\n❌ Some tests failed!")
+    try:
+        with tempfile.TemporaryDirectory() as tmp_path:
+            test_multimedia_storage(tmp_path)
+    except AssertionError as e:
+        print(f"\n❌ Some tests failed: {e}")
         return 1
+    
+    print("\n✅ All tests passed successfully!")
+    return 0
 
 if __name__ == "__main__":
     sys.exit(main())